@@ -59,9 +59,9 @@ class DAGComparison():
         l_r = pcresult.results_in_area(conf, src_dir, self.area)
         for r in l_r:
             edict = {}
-            for line in ld.iter_lines(top_dt = r.top_dt, end_dt = r.end_dt,
-                    area = r.area):
-                weid = self.w_evmap.process_line(line)
+            for gid, host in ld.iter_events([gid_name, "host"],
+                    top_dt = r.top_dt, end_dt = r.end_dt, area = r.area):
+                weid = self.w_evmap.process_event(gid, host)
                 edict[weid] = edict.get(weid, 0) + 1
             self.d_ev[(r.top_dt, r.end_dt, r.area)] = edict
 
@@ -134,9 +134,9 @@ def similar_block_log(conf, top_dt, end_dt, area, ignore_same = True):
     edict = dagc.data_for_cond(top_dt, end_dt, area)
     if edict is None:
         edict = {}
-        for line in ld.iter_lines(top_dt = top_dt, end_dt = end_dt,
-                area = area):
-            weid = dagc.w_evmap.process_line(line)
+        for gid, host in ld.iter_events([dagc.w_evmap.gid_name, "host"],
+                top_dt = top_dt, end_dt = end_dt, area = area):
+            weid = dagc.w_evmap.process_event(gid, host)
             edict[weid] = edict.get(weid, 0) + 1
     l_weid = edict.keys()
     src_evv = _event_vector(l_weid, edict, dagc)
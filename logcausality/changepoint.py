@@ -163,7 +163,7 @@ class ChangePointData():
                 l_data = []
                 l_score = []
 
-            l_dt = [line.dt for line in ld.iter_lines(
+            l_dt = [row[0] for row in ld.iter_events(["dt"],
                     **self._evmap.iterline_args(eid, top_dt, end_dt))]
             if len(l_dt) > 0:
                 _logger.info("{0} messages in given term".format(len(l_dt)))
@@ -2,6 +2,7 @@
 # coding: utf-8
 
 import os
+import io
 import time
 import datetime
 import logging
@@ -107,6 +108,96 @@ class IDDict():
         return self._d_obj[keyid]
 
 
+class LRUCache():
+    """A dictionary-like cache that keeps at most 'size' items.
+    If the cache is full, the least recently used item is discarded.
+
+    Attributes:
+        size (int): Maximum number of items. If 0, nothing is cached.
+        hit (int): Number of lookups that found cached values.
+        miss (int): Number of lookups that did not find cached values.
+    """
+
+    # items are kept in a circular doubly linked list
+    # of [prev, next, key, value] in the order of usage
+
+    def __init__(self, size):
+        self.size = size
+        self.hit = 0
+        self.miss = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self._d)
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def _move_to_last(self, link):
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+        last = self._root[0]
+        last[1] = self._root[0] = link
+        link[0] = last
+        link[1] = self._root
+
+    def get(self, key, failobj = None):
+        link = self._d.get(key)
+        if link is None:
+            self.miss += 1
+            return failobj
+        else:
+            self.hit += 1
+            self._move_to_last(link)
+            return link[3]
+
+    def put(self, key, val):
+        if self.size <= 0:
+            return
+        link = self._d.get(key)
+        if link is not None:
+            link[3] = val
+            self._move_to_last(link)
+            return
+        if len(self._d) >= self.size:
+            oldest = self._root[1]
+            self._root[1] = oldest[1]
+            oldest[1][0] = self._root
+            del self._d[oldest[2]]
+        last = self._root[0]
+        link = [last, self._root, key, val]
+        last[1] = self._root[0] = self._d[key] = link
+
+    def pop(self, key, *args):
+        link = self._d.pop(key, None)
+        if link is None:
+            if len(args) > 0:
+                return args[0]
+            raise KeyError(key)
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+        return link[3]
+
+    def clear(self):
+        self._d = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def hit_rate(self):
+        cnt = self.hit + self.miss
+        if cnt == 0:
+            return 0.0
+        else:
+            return 1.0 * self.hit / cnt
+
+    def stat(self):
+        """str: Show size, hit and miss counts of the cache."""
+        return "{0}/{1} items, hit {2}, miss {3} ({4:.1%} hit)".format(
+                len(self._d), self.size, self.hit, self.miss,
+                self.hit_rate())
+
+
 # file managing
 
 def is_empty(dirname):
@@ -161,6 +252,75 @@ def recur_dir(args):
     return l_fn
 
 
+COMPRESSED_MAGIC = (("gz", "\x1f\x8b"),
+                    ("bz2", "BZh"),
+                    ("xz", "\xfd7zXZ\x00"))
+
+
+def compressed_type(fp):
+    """Detect compression format of a file with its extension
+    or magic bytes. Return None if the file is not compressed."""
+    ext = os.path.splitext(fp)[1].lstrip(".")
+    if ext in [ctype for ctype, magic in COMPRESSED_MAGIC]:
+        return ext
+    with open(fp, "rb") as f:
+        head = f.read(6)
+    for ctype, magic in COMPRESSED_MAGIC:
+        if head.startswith(magic):
+            return ctype
+    else:
+        return None
+
+
+def open_file(fp):
+    """Open a file to read lines. Compressed files (gzip, bzip2, xz)
+    are decompressed in streaming."""
+    ctype = compressed_type(fp)
+    if ctype == "gz":
+        import gzip
+        return io.BufferedReader(gzip.open(fp, "rb"))
+    elif ctype == "bz2":
+        import bz2
+        return bz2.BZ2File(fp, "r")
+    elif ctype == "xz":
+        try:
+            import lzma
+        except ImportError:
+            from backports import lzma
+        return io.BufferedReader(lzma.open(fp, "rb"))
+    else:
+        return open(fp, "r")
+
+
+def iter_lines(fp, mmap_size = 0, offset = 0):
+    """Yields lines in a file, that can be compressed.
+
+    Args:
+        fp (str): A file path.
+        mmap_size (Optional[int]): If larger than 0, uncompressed files
+            with larger size than this value (bytes) are read with mmap.
+        offset (Optional[int]): Byte offset to start reading.
+            For compressed files, this is the offset in decompressed data.
+    """
+    if mmap_size > 0 and os.path.getsize(fp) > mmap_size and \
+            compressed_type(fp) is None:
+        import mmap
+        with open(fp, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                mm.seek(offset)
+                for line in iter(mm.readline, ""):
+                    yield line
+            finally:
+                mm.close()
+    else:
+        with open_file(fp) as f:
+            if offset > 0:
+                f.seek(offset)
+            for line in f:
+                yield line
+
+
 def mkdir(path):
     if not os.path.exists(path):
         os.mkdir(path)
@@ -17,6 +17,12 @@ class database(object):
     # l_repl : values with given keys are replaced in sql_query
     #          to generate sql with subquery
 
+    # generated sql statements are memoized with the structure of
+    # the arguments (table name, keys, conditions and options)
+    # in self._d_sql, up to this number of statements
+    # (given with database.sql_cache_size in config)
+    sql_cache_size = 1000
+
     def __init__(self, dbpath):
         raise NotImplementedError
 
@@ -75,6 +81,15 @@ class database(object):
     def _index_key(self, tablekey):
         raise NotImplementedError
 
+    def _memo_sql(self, memo_key, sql):
+        if len(self._d_sql) >= self.sql_cache_size:
+            # statements with embedded values (not replaced with args)
+            # can be unlimited, so discard all in that case
+            self._d_sql.clear()
+        if self.sql_cache_size > 0:
+            self._d_sql[memo_key] = sql
+        return sql
+
     def join_sql(self, join_opt, table_name1, table_name2, key1, key2):
         return "{1} {0} join {2} on {1}.{3} = {2}.{4}".format(join_opt,
                 table_name1, table_name2, key1, key2)
@@ -94,13 +109,23 @@ class database(object):
         sql = "create table {0} ({1})".format(table_name, ", ".join(l_def))
         return sql
 
+    def add_column_sql(self, table_name, key):
+        return "alter table {0} add column {1} {2}".format(table_name,
+                key.key, self._table_key_type(key.type))
+
     def create_index_sql(self, table_name, index_name, l_key):
         sql = "create index {0} on {1}({2})".format(index_name,
                 table_name, ", ".join([self._index_key(key) for key in l_key]))
         return sql
 
-    def select_sql(self, table_name, l_key, l_cond = [], opt = []):
+    def select_sql(self, table_name, l_key, l_cond = [], opt = [],
+            order = None):
         # now only "distinct" is allowed for opt
+        memo_key = ("select", table_name, tuple(l_key), tuple(l_cond),
+                    tuple(opt), order)
+        sql = self._d_sql.get(memo_key)
+        if sql is not None:
+            return sql
         sql_header = "select"
         if "distinct" in opt:
             sql_header += " distinct"
@@ -108,42 +133,104 @@ class database(object):
                 table_name)
         if len(l_cond) > 0:
             sql += " where {0}".format(self._cond_state(l_cond))
-        return sql 
+        if order is not None:
+            sql += " order by {0}".format(order)
+        return self._memo_sql(memo_key, sql)
 
     def insert_sql(self, table_name, l_setstate):
+        memo_key = ("insert", table_name, tuple(l_setstate))
+        sql = self._d_sql.get(memo_key)
+        if sql is not None:
+            return sql
         l_key, l_val = zip(*[(ss.key, self._ph(ss.val)) for ss in l_setstate])
         sql = "insert into {0} ({1}) values ({2})".format(table_name,
                 ", ".join(l_key), ", ".join(l_val))
-        return sql
+        return self._memo_sql(memo_key, sql)
 
     def update_sql(self, table_name, l_setstate, l_cond = []):
+        memo_key = ("update", table_name, tuple(l_setstate), tuple(l_cond))
+        sql = self._d_sql.get(memo_key)
+        if sql is not None:
+            return sql
         sql = "update {0} set {1}".format(table_name,
                 self._set_state(l_setstate))
         if len(l_cond) > 0:
             sql += " where {0}".format(self._cond_state(l_cond))
-        return sql 
+        return self._memo_sql(memo_key, sql)
 
     def delete_sql(self, table_name, l_cond = []):
+        memo_key = ("delete", table_name, tuple(l_cond))
+        sql = self._d_sql.get(memo_key)
+        if sql is not None:
+            return sql
         sql = "delete from {0}".format(table_name)
         if len(l_cond) > 0:
             sql += " where {0}".format(self._cond_state(l_cond))
-        return sql
+        return self._memo_sql(memo_key, sql)
+
+    def in_cond(self, keyname, l_varname):
+        """Condition that the value is one of the arguments
+        with given variable names."""
+        return cond(keyname, "in",
+                ", ".join(self._ph(varname) for varname in l_varname), False)
 
     def drop_sql(self, table_name):
         return "drop table {0}".format(table_name)
 
+    def rename_sql(self, table_name, new_table_name):
+        return "alter table {0} rename to {1}".format(table_name,
+                new_table_name)
+
     def execute(self, sql, args):
         raise NotImplementedError
 
+    def executemany(self, sql, l_args):
+        raise NotImplementedError
+
+    def set_autoincrement(self, table_name, last_id):
+        """Make the next auto-incremented id of the table last_id + 1."""
+        raise NotImplementedError
+
     def get_table_names(self):
         raise NotImplementedError
 
+    def get_column_type(self, table_name, key):
+        """str: Declared type of a column in lowercase."""
+        raise NotImplementedError
+
 
 class sqlite3(database):
 
-    def __init__(self, dbpath):
+    # applied in this order, because page_size can not be changed
+    # after the DB is in WAL journal mode
+    pragma_names = ("page_size", "journal_mode", "synchronous",
+                    "cache_size", "mmap_size")
+
+    # not applied to readonly connections
+    pragma_names_write = ("page_size", "journal_mode")
+
+    def __init__(self, dbpath, pragma = None, readonly = False,
+            immutable = False):
+        """
+        Args:
+            dbpath (str): A DB file path.
+            pragma (Optional[dict]): SQLite settings applied in opening
+                the connection. Keys are names in pragma_names.
+            readonly (Optional[bool]): Open the DB in read-only mode.
+                Readonly connections never take write locks.
+            immutable (Optional[bool]): Open the DB without any file
+                locking, in addition to readonly.
+                Use only if the DB is not modified while opened.
+        """
         self.dbpath = dbpath
         self.connect = None
+        self._d_sql = {}
+        if pragma is None:
+            self._pragma = {}
+        else:
+            self._pragma = pragma
+        self._readonly = readonly or immutable
+        self._immutable = immutable
 
     def __del__(self):
         if self.connect is not None:
@@ -152,8 +239,35 @@ class sqlite3(database):
     
     def _open(self):
         import sqlite3 as sqlite3_mod
-        self.connect = sqlite3_mod.connect(self.dbpath)
+        if self._readonly:
+            self.connect = self._connect_readonly(sqlite3_mod)
+        else:
+            self.connect = sqlite3_mod.connect(self.dbpath)
         self.connect.text_factory = str
+        for name in self.pragma_names:
+            if self._readonly and name in self.pragma_names_write:
+                continue
+            if self._pragma.has_key(name):
+                self.connect.execute("pragma {0} = {1}".format(
+                        name, self._pragma[name]))
+
+    def _connect_readonly(self, sqlite3_mod):
+        # python2 sqlite3 module can not request URI filenames,
+        # that are available only if SQLite is built with USE_URI
+        temp = sqlite3_mod.connect(":memory:")
+        l_opt = [row[0] for row in temp.execute("pragma compile_options")]
+        temp.close()
+        if "USE_URI" in l_opt:
+            import urllib
+            uri = "file:{0}?mode=ro".format(
+                    urllib.pathname2url(os.path.abspath(self.dbpath)))
+            if self._immutable:
+                uri += "&immutable=1"
+            return sqlite3_mod.connect(uri)
+        else:
+            connect = sqlite3_mod.connect(self.dbpath)
+            connect.execute("pragma query_only = 1")
+            return connect
     
     def db_exists(self):
         if os.path.exists(self.dbpath):
@@ -162,8 +276,10 @@ class sqlite3(database):
             return False
 
     def reset(self):
-        if os.path.exists(self.dbpath):
-            os.remove(self.dbpath)
+        # -wal and -shm files are left in WAL journal mode
+        for fp in (self.dbpath, self.dbpath + "-wal", self.dbpath + "-shm"):
+            if os.path.exists(fp):
+                os.remove(fp)
 
     def commit(self):
         if self.connect is not None:
@@ -206,11 +322,31 @@ class sqlite3(database):
             cursor.execute(sql, args)
         return cursor
 
+    def executemany(self, sql, l_args):
+        if self.connect is None:
+            self._open()
+        cursor = self.connect.cursor()
+        cursor.executemany(sql, l_args)
+        return cursor
+
+    def set_autoincrement(self, table_name, last_id):
+        sql = "update sqlite_sequence set seq = :seq where name = :name"
+        self.execute(sql, {"seq" : last_id, "name" : table_name})
+
     def get_table_names(self):
         sql = "select name from sqlite_master"
         cursor = self.execute(sql)
         return [row[0] for row in cursor]
 
+    def get_column_type(self, table_name, key):
+        sql = "pragma table_info({0})".format(table_name)
+        for row in self.execute(sql):
+            if row[1] == key:
+                return row[2].lower()
+        else:
+            raise ValueError("no column {0} in table {1}".format(
+                    key, table_name))
+
 
 class mysql(database):
 
@@ -222,6 +358,7 @@ class mysql(database):
         self.user = user
         self.passwd = passwd
         self.connect = None
+        self._d_sql = {}
 
     def __del__(self):
         if self.connect is not None:
@@ -301,11 +438,32 @@ class mysql(database):
             cursor.execute(sql, args)
         return cursor
 
+    def executemany(self, sql, l_args):
+        if self.connect is None:
+            self._open()
+        cursor = self.connect.cursor()
+        cursor.executemany(sql, l_args)
+        return cursor
+
+    def set_autoincrement(self, table_name, last_id):
+        sql = "alter table {0} auto_increment = {1}".format(table_name,
+                int(last_id) + 1)
+        self.execute(sql)
+
     def get_table_names(self):
         sql = "show tables"
         cursor = self.execute(sql)
         return [row[0] for row in cursor]
 
+    def get_column_type(self, table_name, key):
+        sql = "show columns from {0}".format(table_name)
+        for row in self.execute(sql):
+            if row[0] == key:
+                return row[1].lower()
+        else:
+            raise ValueError("no column {0} in table {1}".format(
+                    key, table_name))
+
 
 def tablekey(keyname, typename, attributes = tuple()):
     return TableKey(keyname, typename, tuple(attributes))
@@ -321,3 +479,26 @@ def setstate(keyname, value):
     return Setstate(keyname, value)
 
 
+def test_sql_cache(n = 100000):
+    """Show time to generate sql statements per call,
+    with and without memoization."""
+    import timeit
+    db = sqlite3(":memory:")
+    l_ss = [setstate(k, k) for k in ("ltid", "dt", "host", "words")]
+    l_cond = [cond("ltid", "in", db.select_sql("ltg", ["ltid"],
+                   [cond("ltgid", "=", "ltgid")]), False),
+              cond("dt", ">=", "top_dt"), cond("dt", "<", "end_dt")]
+    l_func = [("insert_sql", lambda: db.insert_sql("log", l_ss)),
+              ("update_sql", lambda: db.update_sql("lt", l_ss[:1], l_cond)),
+              ("select_sql", lambda: db.select_sql("log", ["lid"], l_cond))]
+    for cache_size in (0, database.sql_cache_size):
+        db.sql_cache_size = cache_size
+        db._d_sql.clear()
+        print "sql_cache_size = {0}".format(cache_size)
+        for name, func in l_func:
+            t = timeit.timeit(func, number = n)
+            print "  {0}: {1:.3f} us/call".format(name, t * 1000000.0 / n)
+
+
+if __name__ == "__main__":
+    test_sql_cache()
@@ -65,11 +65,11 @@ def periodic_events(conf, ld, top_dt, end_dt, area, edict, evmap):
 
     # prepare time-series of sampling term
     sample_edict = {}
-    iterobj = ld.iter_lines(top_dt = sample_top_dt_max, end_dt = end_dt,
-            area = area)
-    for line in iterobj:
-        eid = evmap.process_line(line)
-        sample_edict.setdefault(eid, []).append(line.dt)
+    iterobj = ld.iter_events(evmap.event_fields(),
+            top_dt = sample_top_dt_max, end_dt = end_dt, area = area)
+    for gid, host, dt in iterobj:
+        eid = evmap.process_event(gid, host)
+        sample_edict.setdefault(eid, []).append(dt)
 
     # determine interval candidate 
     if search_interval:
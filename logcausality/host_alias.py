@@ -4,9 +4,20 @@
 import ipaddress
 from collections import defaultdict
 
-#import common
+import common
 import config
 
+_NOT_CACHED = object()
+
+
+def _ip_address(string):
+    # ipaddress requires unicode strings in python2
+    try:
+        return ipaddress.ip_address(unicode(string))
+    except ValueError:
+        return None
+
+
 #class HostAlias(common.singleton):
 class HostAlias(object):
 
@@ -15,6 +26,10 @@ class HostAlias(object):
         1 host can not belong to multiple host groups, because
         group definition is used to label and classify variables
         in log templates.
+
+        IP addresses are matched with defined networks and addresses
+        in longest prefix match. Resolved keys of given strings
+        (including undefined ones) are kept in a LRU cache.
     """
 
     def __init__(self, conf):
@@ -23,7 +38,13 @@ class HostAlias(object):
         self._d_ralias = {} # key = host, val = alias
         self._d_group = defaultdict(list) # key = group, val = List[host]
         self._d_rgroup = {} # key = host, val = group
-        self._l_net = []
+        # key = ip version, val = {prefixlen: {network bits: host}}
+        self._d_prefix = defaultdict(dict)
+        # key = ip version, val = List[(prefixlen, shift, {network bits: host})]
+        # in descending order of prefixlen
+        self._d_lpm = {}
+        self._cache = common.LRUCache(
+                conf.getint("database", "host_alias_cache_size"))
         self._open(self.fn)
 
     def _open(self, fn):
@@ -64,24 +85,39 @@ class HostAlias(object):
                 self._d_group[group].append(key)
                 self._d_rgroup[key] = group
 
+        def add_prefix(net, key):
+            d_net = self._d_prefix[net.version].setdefault(net.prefixlen, {})
+            shift = net.max_prefixlen - net.prefixlen
+            d_net[int(net.network_address) >> shift] = key
+            self._d_lpm[net.version] = [
+                    (prefixlen, net.max_prefixlen - prefixlen, d)
+                    for prefixlen, d
+                    in sorted(self._d_prefix[net.version].iteritems(),
+                              reverse = True)]
+
         for name in l_name:
             if "/" in name:
                 try:
-                    net = str(ipaddress.ip_network(name))
-                    add_alias(net, alias)
-                    add_groupdef(net, group)
-                    self._l_net.append(net)
+                    net = ipaddress.ip_network(unicode(name))
                 except ValueError:
                     add_alias(name, alias)
                     add_groupdef(name, group)
+                else:
+                    key = str(net)
+                    add_alias(key, alias)
+                    add_groupdef(key, group)
+                    add_prefix(net, key)
             else:
-                try:
-                    addr = str(ipaddress.ip_address(name))
-                    add_alias(addr, alias)
-                    add_groupdef(addr, group)
-                except ValueError:
+                addr = _ip_address(name)
+                if addr is None:
                     add_alias(name, alias)
                     add_groupdef(name, group)
+                else:
+                    key = str(addr)
+                    add_alias(key, alias)
+                    add_groupdef(key, group)
+                    add_prefix(ipaddress.ip_network(addr), key)
+        self._cache.clear()
 
     def print_definitions(self):
         print "[aliases]"
@@ -94,56 +130,51 @@ class HostAlias(object):
             print(" ".join([str(v) for v in val]))
             print
 
-    def isknown(self, string):
-        try:
-            addr = str(ipaddress.ip_address(string))
-            for net in self._l_net:
-                if addr in net:
-                    return True
-            else:
-                if addr in self._d_ralias.keys():
-                    return True
+    def _search_addr(self, addr):
+        # longest prefix match among defined networks and addresses
+        if not self._d_lpm.has_key(addr.version):
+            return None
+        val = int(addr)
+        for prefixlen, shift, d_net in self._d_lpm[addr.version]:
+            key = d_net.get(val >> shift)
+            if key is not None:
+                return key
+        else:
+            return None
+
+    def _search(self, string):
+        """Return the defined host (name, address or network)
+        that given string matches, or None if not defined."""
+        key = self._cache.get(string, _NOT_CACHED)
+        if key is _NOT_CACHED:
+            addr = _ip_address(string)
+            if addr is None:
+                name = string.lower()
+                if self._d_ralias.has_key(name):
+                    key = name
                 else:
-                    return False
-        except ValueError:
-            name = string.lower()
-            return self._d_ralias.has_key(name)
+                    key = None
+            else:
+                key = self._search_addr(addr)
+            self._cache.put(string, key)
+        return key
+
+    def isknown(self, string):
+        return self._search(string) is not None
 
     def resolve_host(self, string):
-        try:
-            addr = str(ipaddress.ip_address(string))
-            for net in self._l_net:
-                if addr in net:
-                    return self._d_ralias[net]
-            else:
-                if addr in self._d_ralias.keys():
-                    return self._d_ralias[addr]
-                else:
-                    return None
-        except ValueError:
-            name = string.lower()
-            if self._d_ralias.has_key(name):
-                return self._d_ralias[name]
-            else:
-                return None
+        key = self._search(string)
+        if key is None:
+            return None
+        else:
+            return self._d_ralias[key]
 
     def get_group(self, string):
-        try:
-            addr = str(ipaddress.ip_address(string))
-            for net in self._l_net:
-                if addr in net:
-                    return self._d_rgroup[net]
-            else:
-                if addr in self._d_rgroup.keys():
-                    return self._d_rgroup[addr]
-                else:
-                    return None
-        except ValueError:
-            name = string.lower()
-            if self._d_rgroup.has_key(name):
-                return self._d_rgroup[name]
-            else:
-                return None
+        key = self._search(string)
+        if key is None:
+            return None
+        else:
+            return self._d_rgroup.get(key)
 
 
 def test_hostalias(conf):
@@ -92,14 +92,21 @@ class EventDefinitionMap():
             return eid
 
     def _line2evdef(self, line):
-        gid = line.get(self.gid_name)
+        return self._event2evdef(line.get(self.gid_name), line.host)
+
+    def _event2evdef(self, gid, host):
         d = {"type" : self.type_normal,
              "note" : None,
              "gid" : gid,
-             "host" : line.host}
+             "host" : host}
         evdef = EvDef(**d)
         return evdef
 
+    def event_fields(self):
+        """List[str]: Fields for LogData.iter_events, that yields
+        arguments of process_event (or existing_event) and timestamps."""
+        return [self.gid_name, "host", "dt"]
+
     def generate(self, ld, top_dt = None, end_dt = None):
         l = len(self)
         if self.gid_name == "ltid":
@@ -124,7 +131,15 @@ class EventDefinitionMap():
         return len(self) - l
 
     def process_line(self, line):
-        evdef = self._line2evdef(line)
+        return self._process_evdef(self._line2evdef(line))
+
+    def process_event(self, gid, host):
+        """Same as process_line, but with the values of classifying
+        criterions (e.g., given by LogData.iter_events)
+        instead of a LogMessage."""
+        return self._process_evdef(self._event2evdef(gid, host))
+
+    def _process_evdef(self, evdef):
         if self._ermap.has_key(evdef):
             return self._ermap[evdef]
         else:
@@ -134,11 +149,10 @@ class EventDefinitionMap():
             return eid
 
     def existing_line(self, line):
-        evdef = self._line2evdef(line)
-        if self._ermap.has_key(evdef):
-            return self._ermap[evdef]
-        else:
-            return None
+        return self._ermap.get(self._line2evdef(line), None)
+
+    def existing_event(self, gid, host):
+        return self._ermap.get(self._event2evdef(gid, host), None)
 
     def add_virtual_event(self, info, type_id, note):
         d = {"type" : type_id,
@@ -274,10 +288,11 @@ def log2event(conf, ld, top_dt, end_dt, area):
     evmap = EventDefinitionMap(top_dt, end_dt, gid_name)
     edict = {} # key : eid, val : list(datetime.datetime)
 
-    iterobj = ld.iter_lines(top_dt = top_dt, end_dt = end_dt, area = area)
-    for line in iterobj:
-        eid = evmap.process_line(line)
-        edict.setdefault(eid, []).append(line.dt)
+    iterobj = ld.iter_events(evmap.event_fields(),
+            top_dt = top_dt, end_dt = end_dt, area = area)
+    for gid, host, dt in iterobj:
+        eid = evmap.process_event(gid, host)
+        edict.setdefault(eid, []).append(dt)
 
     return edict, evmap
 
@@ -392,15 +407,16 @@ def filter_edict(conf, edict, evmap, ld, top_dt, end_dt, area):
 
 def resize_edict(ld, evmap, end_dt, dt_length, area):
     top_dt = end_dt - dt_length
-    iterobj = ld.iter_lines(top_dt = top_dt, end_dt = end_dt, area = area)
+    iterobj = ld.iter_events(evmap.event_fields(),
+            top_dt = top_dt, end_dt = end_dt, area = area)
 
     edict = {}
-    for line in iterobj:
-        eid = evmap.existing_line(line)
+    for gid, host, dt in iterobj:
+        eid = evmap.existing_event(gid, host)
         if eid is None:
             pass
         else:
-            edict.setdefault(eid, []).append(line.dt)
+            edict.setdefault(eid, []).append(dt)
     return edict
 
 
@@ -728,6 +744,9 @@ def agg_mprocess(l_args, filename, pal=1):
     import multiprocessing
     timer = common.Timer("log2event task", output = _logger)
     timer.start()
+    if len(l_args) > 0:
+        # forked processes use log templates loaded here
+        log_db.init_shared(l_args[0][0])
     if pal > 1:
         l_process = [multiprocessing.Process(
                 name = pc_log.thread_name(*(args[:5])),
@@ -8,9 +8,16 @@ and grouping definitions.
 
 import sys
 import os
+import re
+import bisect
 import datetime
+import calendar
 import sqlite3
 import logging
+import itertools
+import collections
+import cPickle as pickle
+import numpy
 
 import common
 import config
@@ -21,13 +28,20 @@ import lt_common
 import host_alias
 
 _logger = logging.getLogger(__name__.rpartition(".")[-1])
+_re_part_table = re.compile(r"^log_([0-9]{8}|[0-9]{6})$")
 
+# loaded data of DBs to read messages, shared with readonly LogData
+# key : DB identifier given by LogDB, val : dict (see init_shared)
+_d_shared = {}
 
-class LogMessage():
+
+class LogMessage(object):
     """An annotated log message.
     
     An instance have a set of information about 1 log message line,
     including timestamp, hostname, log template, and message contents.
+    Attributes are fixed with __slots__ to save memory of instances,
+    that are generated for each message in DB.
 
     Attributes:
         lid (int): A message identifier in DB.
@@ -37,7 +51,9 @@ class LogMessage():
         l_w (List(str)): A sequence of words in this message.
 
     """
-    
+
+    __slots__ = ("lid", "lt", "dt", "host", "l_w")
+
     def __init__(self, lid, lt, dt, host, l_w):
         """
         Args:
@@ -104,22 +120,31 @@ class LogData():
         ltm (lt_common.LTManager): Log template classifier object.
     """
 
-    def __init__(self, conf, edit = False, reset_db = False):
+    def __init__(self, conf, edit = False, reset_db = False,
+            defer_index = False):
         """
         Args:
             conf (config.ExtendedConfigParser): A common configuration object.
             edit (Optional[bool]): Defaults to False.
                 True if database will be added or edited.
                 False if database is used in readonly mode.
+                In readonly mode, sqlite3 DB is opened as read-only,
+                and data loaded with init_shared is used if available.
             reset_db (Optional[bool]): Defaults to False.
                 If True, database will be reset before following process.
+            defer_index (Optional[bool]): Defaults to False.
+                If True, indexes are not created with new tables.
+                Call db.create_index after loading messages.
 
         """
         self.conf = conf
         self._reset_db = reset_db
         sym = conf.get("log_template", "variable_symbol")
         self.lttable = lt_common.LTTable(sym) # lt_common.LTTable
-        self.db = LogDB(conf, self.lttable, edit, reset_db) # log_db.LogDB
+        self.db = LogDB(conf, self.lttable, edit, reset_db,
+                defer_index) # log_db.LogDB
+        # lttable is replaced if shared one is used
+        self.lttable = self.db.lttable
         self.ltm = None # lt_common.LTManager
         import lt_label
         self.ll = lt_label.init_ltlabel(conf)
@@ -161,6 +186,39 @@ class LogData():
                 if v is not None])))
         return self.db.iter_lines(**kargs)
 
+    def iter_events(self, fields, **kargs):
+        """Generate only given attributes of log messages in DB
+        that satisfy conditions given in arguments.
+        Unlike iter_lines, message words are not read from DB
+        and no LogMessage instance is made.
+        Use this for the analysis only with timestamps, hosts
+        and template identifiers of messages.
+
+        Args:
+            fields (List[str]): Attribute names to yield,
+                in [lid, ltid, ltgid, dt, host].
+            Other arguments are same as iter_lines.
+
+        Yields:
+            tuple: Values of the attributes in the order of fields.
+        """
+        _logger.info("iter_events called ({0})".format(" ".join(
+                ["{0}:{1}".format(k, v) for k, v in kargs.iteritems()
+                if v is not None])))
+        return self.db.iter_events(fields, **kargs)
+
+    def dt_array(self, **kargs):
+        """Get timestamps of log messages that satisfy conditions
+        given in arguments, without making datetime objects for each
+        message. Arguments are same as iter_lines.
+
+        Returns:
+            numpy.ndarray: Timestamps in numpy.datetime64 (seconds).
+                Use astype("int64") to get seconds from epoch
+                (1970-01-01 00:00:00).
+        """
+        return self.db.dt_array(**kargs)
+
     def show_log_repr(self, head = 0, foot = 0,
             ltid = None, ltgid = None,
             top_dt = None, end_dt = None, host = None, area = None):
@@ -236,6 +294,11 @@ class LogData():
         """List[str]: Sequence of all source hostname in DB."""
         return self.db.whole_host(top_dt = top_dt, end_dt = end_dt)
 
+    def count_host_lt(self, top_dt = None, end_dt = None):
+        """Dict[(str, int), int]: Number of log messages
+        for each combination of hostname and ltid in DB."""
+        return self.db.count_host_lt(top_dt = top_dt, end_dt = end_dt)
+
     def count_lt(self):
         """int: Number of all log templates."""
         return self.db.count_lt()
@@ -375,12 +438,32 @@ class LogData():
     def update_area(self):
         self.db._init_area()
 
+    def remove_lines_before(self, dt):
+        """Remove log messages before given datetime from DB,
+        and decrease counts of their log templates.
+
+        Returns:
+            int: Number of removed messages.
+        """
+        d_cnt = self.db.remove_lines_before(dt)
+        l_count = []
+        for ltid, cnt in d_cnt.iteritems():
+            ltline = self.lttable[ltid]
+            ltline.cnt -= cnt
+            l_count.append((ltid, ltline.cnt))
+        self.db.update_lt_count(l_count)
+        return sum(d_cnt.values())
+
     def commit_db(self):
         """Commit requested changes in LogDB.
         """
+        if self.ltm is not None:
+            self.ltm.flush_count()
         self.db.commit()
         if self.ltm is not None:
             self.ltm.dump()
+        # shared data is not consistent with edited DB
+        _d_shared.pop(self.db.key, None)
 
 
 class LogDB():
@@ -391,11 +474,28 @@ class LogDB():
         Instead, use LogData.
     """
 
-    def __init__(self, conf, lttable, edit, reset_db):
+    # areas with more hosts than this are given to DB as subqueries
+    area_cond_limit = 500
+
+    def __init__(self, conf, lttable, edit, reset_db, defer_index = False):
         self.lttable = lttable
+        self._defer_index = defer_index
         self._line_cnt = 0
         self.areafn = conf.get("database", "area_filename")
         self._splitter = conf.get("database", "split_symbol")
+        self._insert_buffer_size = conf.getint("database",
+                "insert_buffer_size")
+        self._d_insert = {} # key : log table name, val : buffered arguments
+        self._insert_cnt = 0
+        self._words_format = conf.get("database", "words_format")
+        self._d_base = {} # key : ltid, val : base words for diff format
+        self._dt_format = conf.get("database", "dt_format")
+        self._partition = conf.get("database", "log_partition")
+        self._l_part = [] # sorted keys of partitioned log tables
+        self._ltgid_column = conf.getboolean("database", "log_ltgid_column")
+        self._d_area = None # key : area, val : set of hosts
+        self._catalog = conf.getboolean("database", "log_catalog")
+        self._d_catalog = {} # key : (day, host, ltid), val : buffered stat
 
         db_type = conf.get("database", "database")
         if db_type == "sqlite3":
@@ -403,16 +503,26 @@ class LogDB():
             if dbpath is None:
                 # for compatibility
                 dbpath = conf.get("database", "db_filename")
-            self.db = db_common.sqlite3(dbpath)
+            pragma = {}
+            for name in db_common.sqlite3.pragma_names:
+                val = conf.get("database", "sqlite3_" + name)
+                if not val == "":
+                    pragma[name] = val
+            immutable = conf.getboolean("database", "sqlite3_immutable")
+            self.db = db_common.sqlite3(dbpath, pragma,
+                    readonly = not edit, immutable = immutable and not edit)
+            self.key = (db_type, os.path.abspath(dbpath))
         elif db_type == "mysql":
             host = conf.get("database", "mysql_host")
             dbname = conf.get("database", "mysql_dbname")
             user = conf.get("database", "mysql_user")
             passwd = conf.get("database", "mysql_passwd")
             self.db = db_common.mysql(host, dbname, user, passwd)
+            self.key = (db_type, host, dbname)
         else:
             raise ValueError("invalid database type ({0})".format(
                     db_type))
+        self.db.sql_cache_size = conf.getint("database", "sql_cache_size")
 
         if edit:
             if self.db.db_exists():
@@ -421,8 +531,13 @@ class LogDB():
                     self._init_tables()
                     self._init_area()
                 else:
+                    self._init_partition()
+                    self._init_ltgid_column()
+                    self._init_catalog()
                     self._line_cnt = self.count_lines()
+                    self._init_dt_format()
                     self._init_lttable()
+                    self._init_ltbase()
             else:
                 if reset_db == True:
                     _logger.warning(
@@ -430,22 +545,49 @@ class LogDB():
                 self._init_tables()
                 self._init_area()
         else: 
+            # lid counter (count_lines) is not needed without adding lines
             if self.db.db_exists():
-                self._line_cnt = self.count_lines()
-                self._init_lttable()
+                if _d_shared.has_key(self.key):
+                    self._load_shared(_d_shared[self.key])
+                else:
+                    self._init_partition()
+                    self._init_ltgid_column()
+                    self._init_catalog()
+                    self._init_dt_format()
+                    self._init_lttable()
+                    self._init_ltbase()
             else:
                 raise IOError("database not found")
 
+    def _dump_shared(self):
+        return {"lttable" : self.lttable,
+                "partition" : self._partition,
+                "l_part" : self._l_part,
+                "dt_format" : self._dt_format,
+                "words_format" : self._words_format,
+                "d_base" : self._d_base,
+                "ltgid_column" : self._ltgid_column,
+                "catalog" : self._catalog,
+                "d_area" : self._area_map()}
+
+    def _load_shared(self, d_shared):
+        # shared objects are not edited in readonly mode
+        self.lttable = d_shared["lttable"]
+        self._partition = d_shared["partition"]
+        self._l_part = d_shared["l_part"]
+        self._dt_format = d_shared["dt_format"]
+        self._words_format = d_shared["words_format"]
+        self._d_base = d_shared["d_base"]
+        self._ltgid_column = d_shared["ltgid_column"]
+        self._catalog = d_shared["catalog"]
+        self._d_area = d_shared["d_area"]
+
     def _init_tables(self):
-        table_name = "log"
-        l_key = [db_common.tablekey("lid", "integer",
-                    ("primary_key", "auto_increment", "not_null")),
-                 db_common.tablekey("ltid", "integer"),
-                 db_common.tablekey("dt", "datetime"),
-                 db_common.tablekey("host", "text"),
-                 db_common.tablekey("words", "text")]
-        sql = self.db.create_table_sql(table_name, l_key)
-        self.db.execute(sql)
+        if self._partition == "none":
+            self._init_log_table("log")
+        elif not self._partition in ("day", "month"):
+            raise ValueError("invalid log_partition ({0})".format(
+                    self._partition))
 
         table_name = "lt"
         l_key = [db_common.tablekey("ltid", "integer", ("primary_key",)),
@@ -469,19 +611,371 @@ class LogDB():
         sql = self.db.create_table_sql(table_name, l_key)
         self.db.execute(sql)
 
+        if self._words_format == "diff":
+            self._init_ltbase_table()
+        elif not self._words_format == "plain":
+            raise ValueError("invalid words_format ({0})".format(
+                    self._words_format))
+
+        if self._catalog:
+            self._init_catalog_table()
+
+        if not self._defer_index:
+            self._init_index()
+
+    def _init_log_table(self, table_name):
+        if self._dt_format == "epoch":
+            dt_type = "integer"
+        elif self._dt_format == "text":
+            dt_type = "datetime"
+        else:
+            raise ValueError("invalid dt_format ({0})".format(
+                    self._dt_format))
+        l_key = [db_common.tablekey("lid", "integer",
+                    ("primary_key", "auto_increment", "not_null")),
+                 db_common.tablekey("ltid", "integer"),
+                 db_common.tablekey("dt", dt_type),
+                 db_common.tablekey("host", "text"),
+                 db_common.tablekey("words", "text")]
+        if self._ltgid_column:
+            l_key.append(db_common.tablekey("ltgid", "integer"))
+        sql = self.db.create_table_sql(table_name, l_key)
+        self.db.execute(sql)
+
+    def _init_ltgid_column(self):
+        # ltgid column of existing DB is given by DB, not config
+        l_table_name = self._log_tables()
+        if len(l_table_name) == 0:
+            # partitioned DB without messages
+            return
+        try:
+            self.db.get_column_type(l_table_name[0], "ltgid")
+        except ValueError:
+            self._ltgid_column = False
+        else:
+            self._ltgid_column = True
+
+    def add_ltgid_column(self):
+        """Add ltgid column and its indexes to log tables of existing DB,
+        with current log template groups."""
+        self.flush_lines()
+        if self._ltgid_column:
+            return
+        key = db_common.tablekey("ltgid", "integer")
+        for table_name in self._log_tables():
+            self.db.execute(self.db.add_column_sql(table_name, key))
+        self._ltgid_column = True
+        self.update_log_ltgid()
         self._init_index()
 
-    def _init_index(self):
+    def update_log_ltgid(self, l_ltid = None):
+        """Set ltgid column of log messages with log template groups
+        in lttable. Call this after changing log template groups
+        of existing messages.
+
+        Args:
+            l_ltid (Optional[List[int]]): Log templates of messages
+                to update. If None, all messages are updated.
+        """
+        if not self._ltgid_column:
+            return
+        self.flush_lines()
+        if l_ltid is None:
+            l_ltid = [ltline.ltid for ltline in self.lttable]
+        l_args = [{"ltid" : ltid, "ltgid" : self.lttable[ltid].ltgid}
+                  for ltid in l_ltid]
+        l_ss = [db_common.setstate("ltgid", "ltgid")]
+        l_cond = [db_common.cond("ltid", "=", "ltid")]
+        for table_name in self._log_tables():
+            sql = self.db.update_sql(table_name, l_ss, l_cond)
+            self.db.executemany(sql, l_args)
+
+    def _init_catalog(self):
+        # catalog of existing DB is given by DB, not config
+        self._catalog = "catalog" in self.db.get_table_names()
+
+    def _init_catalog_table(self):
+        # timestamps in catalog are epoch seconds in any dt_format,
+        # and day is the epoch of 00:00:00 (UTC) of the day
+        table_name = "catalog"
+        l_key = [db_common.tablekey("day", "integer"),
+                 db_common.tablekey("host", "text"),
+                 db_common.tablekey("ltid", "integer"),
+                 db_common.tablekey("count", "integer"),
+                 db_common.tablekey("first_dt", "integer"),
+                 db_common.tablekey("last_dt", "integer")]
+        sql = self.db.create_table_sql(table_name, l_key)
+        self.db.execute(sql)
+
+        # indexes of catalog are used in adding messages, not deferred
+        index_name = "catalog_index"
+        l_key = [db_common.tablekey("ltid", "integer"),
+                 db_common.tablekey("host", "text", (100, )),
+                 db_common.tablekey("day", "integer")]
+        sql = self.db.create_index_sql(table_name, index_name, l_key)
+        self.db.execute(sql)
+        index_name = "catalog_day_index"
+        l_key = [db_common.tablekey("day", "integer")]
+        sql = self.db.create_index_sql(table_name, index_name, l_key)
+        self.db.execute(sql)
+
+    def build_catalog(self, batch_size = 10000):
+        """Make catalog of existing log messages in DB."""
+        self.flush_lines()
+        if self._catalog:
+            return
+        self._init_catalog_table()
+        self._catalog = True
+        l_key = ["dt", "host", "ltid"]
+        l_cond = [db_common.cond("lid", ">=", "top"),
+                  db_common.cond("lid", "<", "end")]
+        for table_name in self._log_tables():
+            sql = self.db.select_sql(table_name, l_key, l_cond)
+            min_lid, max_lid = self._lid_range(table_name)
+            for top in xrange(min_lid, max_lid + 1, batch_size):
+                args = {"top" : top, "end" : top + batch_size}
+                for dt, host, ltid in self.db.execute(sql, args).fetchall():
+                    self._add_catalog(self._epoch(dt), host, int(ltid))
+                self._flush_catalog()
+
+    def _epoch(self, val):
+        # epoch seconds of a timestamp value in log tables
+        if self._dt_format == "epoch":
+            return int(val)
+        else:
+            return calendar.timegm(self.db.datetime(val).timetuple())
+
+    def _epoch_dt(self, dt):
+        # epoch seconds of a given datetime, regarded as UTC
+        if isinstance(dt, str):
+            dt = self.db.strptime(dt)
+        return calendar.timegm(dt.timetuple())
+
+    def _add_catalog(self, t, host, ltid):
+        key = (t - t % 86400, host, ltid)
+        stat = self._d_catalog.get(key)
+        if stat is None:
+            self._d_catalog[key] = [1, t, t]
+        else:
+            stat[0] += 1
+            if t < stat[1]:
+                stat[1] = t
+            elif t > stat[2]:
+                stat[2] = t
+
+    def _flush_catalog(self):
+        # merge buffered stats into catalog
+        if len(self._d_catalog) == 0:
+            return
+        d_catalog = self._d_catalog
+        self._d_catalog = {}
+        table_name = "catalog"
+        l_cond = [db_common.cond("day", "=", "day"),
+                  db_common.cond("host", "=", "host"),
+                  db_common.cond("ltid", "=", "ltid")]
+        sql_select = self.db.select_sql(table_name,
+                ["count", "first_dt", "last_dt"], l_cond)
+        l_ss = [db_common.setstate(k, k)
+                for k in ("count", "first_dt", "last_dt")]
+        sql_update = self.db.update_sql(table_name, l_ss, l_cond)
+        l_ss = [db_common.setstate(k, k) for k in ("day", "host", "ltid",
+                "count", "first_dt", "last_dt")]
+        sql_insert = self.db.insert_sql(table_name, l_ss)
+        l_update = []
+        l_insert = []
+        for (day, host, ltid), (cnt, first, last) in \
+                sorted(d_catalog.iteritems()):
+            args = {"day" : day, "host" : host, "ltid" : ltid}
+            row = self.db.execute(sql_select, args).fetchone()
+            if row is None:
+                l_insert.append(args)
+            else:
+                cnt += int(row[0])
+                first = min(first, int(row[1]))
+                last = max(last, int(row[2]))
+                l_update.append(args)
+            args.update({"count" : cnt, "first_dt" : first,
+                         "last_dt" : last})
+        if len(l_update) > 0:
+            self.db.executemany(sql_update, l_update)
+        if len(l_insert) > 0:
+            self.db.executemany(sql_insert, l_insert)
+
+    def _catalog_keys(self, d_cond):
+        # keys of catalog for messages satisfying d_cond
+        s_key = set()
+        for dt, host, ltid in self._select_log(d_cond,
+                ["dt", "host", "ltid"]):
+            t = self._epoch(dt)
+            s_key.add((t - t % 86400, host, int(ltid)))
+        return s_key
+
+    def _refresh_catalog(self, s_key):
+        # count messages of given catalog keys again with log tables
+        self.flush_lines()
+        table_name = "catalog"
+        l_cond = [db_common.cond("day", "=", "day"),
+                  db_common.cond("host", "=", "host"),
+                  db_common.cond("ltid", "=", "ltid")]
+        sql_delete = self.db.delete_sql(table_name, l_cond)
+        l_ss = [db_common.setstate(k, k) for k in ("day", "host", "ltid",
+                "count", "first_dt", "last_dt")]
+        sql_insert = self.db.insert_sql(table_name, l_ss)
+        for day, host, ltid in sorted(s_key):
+            args = {"day" : day, "host" : host, "ltid" : ltid}
+            self.db.execute(sql_delete, args)
+            d_cond = {"ltid" : ltid, "host" : host,
+                    "top_dt" : datetime.datetime.utcfromtimestamp(day),
+                    "end_dt" : datetime.datetime.utcfromtimestamp(
+                        day + 86400)}
+            l_t = [self._epoch(row[0])
+                   for row in self._select_log(d_cond, ["dt"])]
+            if len(l_t) > 0:
+                args.update({"count" : len(l_t), "first_dt" : min(l_t),
+                             "last_dt" : max(l_t)})
+                self.db.execute(sql_insert, args)
+
+    def _init_partition(self):
+        # partitioning of existing DB is given by DB, not config
         l_table_name = self.db.get_table_names()
+        if "log" in l_table_name:
+            self._partition = "none"
+            return
+        for name in l_table_name:
+            mo = _re_part_table.match(name)
+            if mo:
+                self._l_part.append(mo.group(1))
+        self._l_part.sort()
+        if len(self._l_part) > 0:
+            if len(self._l_part[0]) == 8:
+                self._partition = "day"
+            else:
+                self._partition = "month"
+
+    def _part_key(self, dt):
+        if isinstance(dt, str):
+            dt = self.db.strptime(dt)
+        if self._partition == "day":
+            return "{0:04d}{1:02d}{2:02d}".format(dt.year, dt.month, dt.day)
+        else:
+            return "{0:04d}{1:02d}".format(dt.year, dt.month)
 
-        table_name = "log"
-        index_name = "log_index"
+    def _part_term(self, key):
+        if self._partition == "day":
+            top_dt = datetime.datetime.strptime(key, "%Y%m%d")
+            end_dt = top_dt + datetime.timedelta(days = 1)
+        else:
+            top_dt = datetime.datetime.strptime(key, "%Y%m")
+            end_dt = (top_dt + datetime.timedelta(days = 32)).replace(day = 1)
+        return top_dt, end_dt
+
+    def _part_table(self, dt):
+        # log table for given timestamp, made if not exists
+        key = self._part_key(dt)
+        i = bisect.bisect_left(self._l_part, key)
+        if i == len(self._l_part) or not self._l_part[i] == key:
+            table_name = "log_" + key
+            self._init_log_table(table_name)
+            if not self._defer_index:
+                self._init_log_index(table_name)
+            self._l_part.insert(i, key)
+        return "log_" + key
+
+    def _log_tables(self, top_dt = None, end_dt = None):
+        """List[str]: Names of log tables in time order. If top_dt or
+        end_dt is given, tables without messages in the term are
+        excluded (in partitioned DB)."""
+        if self._partition == "none":
+            return ["log"]
+        if top_dt is None:
+            top = 0
+        else:
+            top = bisect.bisect_left(self._l_part, self._part_key(top_dt))
+        if end_dt is None:
+            end = len(self._l_part)
+        else:
+            if isinstance(end_dt, str):
+                end_dt = self.db.strptime(end_dt)
+            end_key = self._part_key(end_dt)
+            end = bisect.bisect_left(self._l_part, end_key)
+            if end < len(self._l_part) and self._l_part[end] == end_key \
+                    and end_dt > self._part_term(end_key)[0]:
+                end += 1
+        return ["log_" + key for key in self._l_part[top:end]]
+
+    def _cond_tables(self, d_cond):
+        return self._log_tables(d_cond.get("top_dt"), d_cond.get("end_dt"))
+
+    def _init_dt_format(self):
+        # dt format of existing DB is given by DB, not config
+        l_table_name = self._log_tables()
+        if len(l_table_name) == 0:
+            # partitioned DB without messages
+            return
+        if self.db.get_column_type(l_table_name[0], "dt").startswith("int"):
+            self._dt_format = "epoch"
+        else:
+            self._dt_format = "text"
+
+    def _encode_dt(self, dt):
+        if self._dt_format == "epoch":
+            if isinstance(dt, str):
+                dt = self.db.strptime(dt)
+            # naive datetime is regarded as UTC, not to depend on timezone
+            return calendar.timegm(dt.timetuple())
+        else:
+            return self.db.strftime(dt)
+
+    def _decode_dt(self, val):
+        if self._dt_format == "epoch":
+            return datetime.datetime.utcfromtimestamp(val)
+        else:
+            return self.db.datetime(val)
+
+    def _init_ltbase_table(self):
+        table_name = "ltbase"
+        l_key = [db_common.tablekey("ltid", "integer", ("primary_key",)),
+                 db_common.tablekey("words", "text")]
+        sql = self.db.create_table_sql(table_name, l_key)
+        self.db.execute(sql)
+
+    def create_index(self):
+        """Create indexes not existing in DB. Indexes are built at once
+        here, if they are deferred in loading messages."""
+        self._init_index()
+
+    def _init_log_index(self, table_name, l_table_name = None):
+        if table_name == "log":
+            index_name = "log_index"
+        else:
+            index_name = table_name + "_index"
         l_key = [db_common.tablekey("ltid", "integer"),
                  db_common.tablekey("dt", "datetime"),
                  db_common.tablekey("host", "text", (100, ))]
-        if not index_name in l_table_name:
+        if l_table_name is None or not index_name in l_table_name:
             sql = self.db.create_index_sql(table_name, index_name, l_key)
             self.db.execute(sql)
+
+        if self._ltgid_column:
+            d_index = {
+                "ltgid" : [db_common.tablekey("ltgid", "integer"),
+                           db_common.tablekey("dt", "datetime"),
+                           db_common.tablekey("host", "text", (100, ))],
+                "host" : [db_common.tablekey("host", "text", (100, )),
+                          db_common.tablekey("dt", "datetime"),
+                          db_common.tablekey("ltgid", "integer")]}
+            for name, l_key in sorted(d_index.iteritems()):
+                index_name = "{0}_{1}_index".format(table_name, name)
+                if l_table_name is None or not index_name in l_table_name:
+                    sql = self.db.create_index_sql(table_name, index_name,
+                            l_key)
+                    self.db.execute(sql)
+
+    def _init_index(self):
+        l_table_name = self.db.get_table_names()
+
+        for table_name in self._log_tables():
+            self._init_log_index(table_name, l_table_name)
             
         table_name = "ltg"
         index_name = "ltg_index"
@@ -498,23 +992,128 @@ class LogDB():
             self.db.execute(sql)
 
     def commit(self):
+        self.flush_lines()
         self.db.commit()
-    
+
+    def _insert_line_sql(self, table_name):
+        l_key = ["ltid", "dt", "host", "words"]
+        if self._ltgid_column:
+            l_key.append("ltgid")
+        if not self._partition == "none":
+            # lid is given by LogDB to be unique in all partitions
+            l_key = ["lid"] + l_key
+        l_ss = [db_common.setstate(k, k) for k in l_key]
+        return self.db.insert_sql(table_name, l_ss)
+
+    def _init_ltbase(self):
+        # words format of existing DB is given by DB, not config
+        self._d_base = {}
+        if "ltbase" in self.db.get_table_names():
+            self._words_format = "diff"
+            table_name = "ltbase"
+            l_key = ["ltid", "words"]
+            sql = self.db.select_sql(table_name, l_key)
+            cursor = self.db.execute(sql)
+            for row in cursor:
+                self._d_base[int(row[0])] = self._split_words(row[1])
+        else:
+            self._words_format = "plain"
+
+    def _add_ltbase(self, ltid, l_w):
+        self._d_base[ltid] = l_w[:]
+        table_name = "ltbase"
+        l_ss = [db_common.setstate("ltid", "ltid"),
+                db_common.setstate("words", "words")]
+        args = {"ltid" : ltid, "words" : self._splitter.join(l_w)}
+        sql = self.db.insert_sql(table_name, l_ss)
+        self.db.execute(sql, args)
+
+    def _split_words(self, string):
+        if string == "":
+            return []
+        else:
+            return strutil.split_igesc(string, self._splitter)
+
+    def _encode_words(self, ltid, l_w):
+        # diff format : words different from the base words of the
+        # log template (the first message of it), with their positions
+        # e.g. "3@@192.168.0.1@@7@@down"
+        # messages with different length from the base are
+        # stored in plain format with "!" at the head
+        if self._words_format == "plain":
+            return self._splitter.join(l_w)
+        base = self._d_base.get(ltid)
+        if base is None:
+            self._add_ltbase(ltid, l_w)
+            return ""
+        elif not len(base) == len(l_w):
+            return "!" + self._splitter.join(l_w)
+        l_diff = []
+        for wid, (w, base_w) in enumerate(zip(l_w, base)):
+            if not w == base_w:
+                l_diff.append(str(wid))
+                l_diff.append(w)
+        return self._splitter.join(l_diff)
+
+    def _decode_words(self, ltid, string):
+        if self._words_format == "plain":
+            return self._split_words(string)
+        elif string.startswith("!"):
+            return self._split_words(string[1:])
+        l_w = self._d_base[ltid][:]
+        if not string == "":
+            l_diff = strutil.split_igesc(string, self._splitter)
+            for i in xrange(0, len(l_diff), 2):
+                l_w[int(l_diff[i])] = l_diff[i + 1]
+        return l_w
+
     def add_line(self, ltid, dt, host, l_w):
-        table_name = "log"
         d_val = {
             "ltid" : ltid,
-            "dt" : self.db.strftime(dt),
+            "dt" : self._encode_dt(dt),
             "host" : host,
-            "words" : self._splitter.join(l_w),
+            "words" : self._encode_words(ltid, l_w),
         }
-        l_ss = [db_common.setstate(k, k) for k in d_val.keys()]
-        sql = self.db.insert_sql(table_name, l_ss)
-        self.db.execute(sql, d_val)
-        
+        if self._ltgid_column:
+            d_val["ltgid"] = self.lttable[ltid].ltgid
+        if self._catalog:
+            if self._dt_format == "epoch":
+                t = d_val["dt"]
+            else:
+                t = self._epoch_dt(dt)
+            self._add_catalog(t, host, ltid)
+        if self._partition == "none":
+            table_name = "log"
+        else:
+            table_name = self._part_table(dt)
+            self._line_cnt += 1
+            d_val["lid"] = self._line_cnt
+        if self._insert_buffer_size > 1:
+            self._d_insert.setdefault(table_name, []).append(d_val)
+            self._insert_cnt += 1
+            if self._insert_cnt >= self._insert_buffer_size:
+                self.flush_lines()
+        else:
+            sql = self._insert_line_sql(table_name)
+            self.db.execute(sql, d_val)
+
+    def flush_lines(self):
+        """Insert all buffered log messages into DB with 1 statement
+        for each log table. The inserted rows belong to current transaction,
+        and they are fixed with commit."""
+        if self._catalog:
+            self._flush_catalog()
+        if self._insert_cnt == 0:
+            return
+        d_insert = self._d_insert
+        self._d_insert = {}
+        self._insert_cnt = 0
+        for table_name, l_args in sorted(d_insert.iteritems()):
+            sql = self._insert_line_sql(table_name)
+            self.db.executemany(sql, l_args)
 
-    def iter_lines(self, lid = None, ltid = None, ltgid = None, top_dt = None,
-            end_dt = None, host = None, area = None):
+
+    def _iter_cond(self, lid, ltid, ltgid, top_dt, end_dt, host, area):
         d_cond = {}
         if lid is not None: d_cond["lid"] = lid
         if ltid is not None: d_cond["ltid"] = ltid
@@ -531,18 +1130,68 @@ class LogDB():
 
         if len(d_cond) == 0:
             raise ValueError("More than 1 argument should NOT be None")
+        return d_cond
 
+    def iter_lines(self, lid = None, ltid = None, ltgid = None, top_dt = None,
+            end_dt = None, host = None, area = None):
+        d_cond = self._iter_cond(lid, ltid, ltgid, top_dt, end_dt, host, area)
         for row in self._select_log(d_cond):
             lid = int(row[0])
             ltid = int(row[1])
-            dt = self.db.datetime(row[2])
+            dt = self._decode_dt(row[2])
             host = row[3]
-            if row[4] == "":
-                l_w = []
-            else:
-                l_w = strutil.split_igesc(row[4], self._splitter)
+            l_w = self._decode_words(ltid, row[4])
             yield LogMessage(lid, self.lttable[ltid], dt, host, l_w)
 
+    def iter_events(self, fields, lid = None, ltid = None, ltgid = None,
+            top_dt = None, end_dt = None, host = None, area = None):
+        d_cond = self._iter_cond(lid, ltid, ltgid, top_dt, end_dt, host, area)
+        l_key = []
+        for field in fields:
+            if field not in ("lid", "ltid", "ltgid", "dt", "host"):
+                raise ValueError("invalid field name {0}".format(field))
+            # ltgid is given from lttable, not from DB
+            key = "ltid" if field == "ltgid" else field
+            if key not in l_key:
+                l_key.append(key)
+        l_func = []
+        for field in fields:
+            idx = l_key.index("ltid" if field == "ltgid" else field)
+            if field == "ltgid":
+                l_func.append(lambda row, idx = idx:
+                        self.lttable[int(row[idx])].ltgid)
+            elif field == "dt":
+                l_func.append(lambda row, idx = idx:
+                        self._decode_dt(row[idx]))
+            elif field == "host":
+                l_func.append(lambda row, idx = idx: row[idx])
+            else:
+                l_func.append(lambda row, idx = idx: int(row[idx]))
+
+        # without order, DB can scan covering index in different order
+        # from iter_lines
+        for row in self._select_log(d_cond, l_key, order = "lid"):
+            yield tuple(func(row) for func in l_func)
+
+    def dt_array(self, lid = None, ltid = None, ltgid = None, top_dt = None,
+            end_dt = None, host = None, area = None):
+        d_cond = self._iter_cond(lid, ltid, ltgid, top_dt, end_dt, host, area)
+        self.flush_lines()
+        args = d_cond.copy()
+        l_key = ["dt"]
+        l_cond = self._log_cond(d_cond, args)
+        iterobj = itertools.chain.from_iterable(
+                self.db.execute(self.db.select_sql(table_name, l_key, l_cond),
+                                args)
+                for table_name in self._cond_tables(d_cond))
+        if self._dt_format == "epoch":
+            return numpy.fromiter((row[0] for row in iterobj),
+                    dtype = numpy.int64).astype("datetime64[s]")
+        else:
+            # numpy parses datetime strings without making datetime objects
+            return numpy.array([row[0] for row in iterobj],
+                    dtype = "datetime64[s]")
+
     def iter_words(self, lid = None, ltid = None, ltgid = None, top_dt = None,
             end_dt = None, host = None, area = None):
         d_cond = {}
@@ -556,120 +1205,355 @@ class LogDB():
         if len(d_cond) == 0:
             raise ValueError("More than 1 argument should NOT be None")
         for row in self._select_log(d_cond):
-            if row[4] == "":
-                yield []
-            else:
-                yield strutil.split_igesc(row[4], self._splitter)
+            yield self._decode_words(int(row[1]), row[4])
 
-    def _select_log(self, d_cond):
+    def _select_log(self, d_cond, l_key = None, order = None):
         if len(d_cond) == 0:
             raise ValueError("called select with empty condition")
+        self.flush_lines()
         args = d_cond.copy()
 
-        table_name = "log"
-        l_key = ["lid", "ltid", "dt", "host", "words"]
+        if l_key is None:
+            l_key = ["lid", "ltid", "dt", "host", "words"]
+        l_cond = self._log_cond(d_cond, args)
+        for table_name in self._cond_tables(d_cond):
+            sql = self.db.select_sql(table_name, l_key, l_cond,
+                    order = order)
+            for row in self.db.execute(sql, args):
+                yield row
+
+    def _log_cond(self, d_cond, args):
         l_cond = []
         for c in d_cond.keys():
-            if c == "ltgid":
+            if c == "ltgid" and self._ltgid_column:
+                l_cond.append(db_common.cond(c, "=", c))
+            elif c == "ltgid":
                 sql= self.db.select_sql("ltg", ["ltid"],
                         [db_common.cond(c, "=", c)])
                 l_cond.append(db_common.cond("ltid", "in", sql, False))
             elif c == "area":
-                sql= self.db.select_sql("area", ["host"],
-                        [db_common.cond(c, "=", c)])
-                l_cond.append(db_common.cond("host", "in", sql, False))
+                s_host = self._area_map().get(d_cond[c], set())
+                if 0 < len(s_host) <= self.area_cond_limit:
+                    # hosts given as arguments to use index of host
+                    l_varname = []
+                    for i, host in enumerate(sorted(s_host)):
+                        varname = "area_host{0}".format(i)
+                        args[varname] = host
+                        l_varname.append(varname)
+                    l_cond.append(self.db.in_cond("host", l_varname))
+                else:
+                    sql= self.db.select_sql("area", ["host"],
+                            [db_common.cond(c, "=", c)])
+                    l_cond.append(db_common.cond("host", "in", sql, False))
             elif c == "top_dt":
                 l_cond.append(db_common.cond("dt", ">=", c))
-                args[c] = self.db.strftime(d_cond[c])
+                args[c] = self._encode_dt(d_cond[c])
             elif c == "end_dt":
                 l_cond.append(db_common.cond("dt", "<", c))
-                args[c] = self.db.strftime(d_cond[c])
+                args[c] = self._encode_dt(d_cond[c])
             else:
                 l_cond.append(db_common.cond(c, "=", c))
-        sql = self.db.select_sql(table_name, l_key, l_cond)
-        return self.db.execute(sql, args)
+        return l_cond
 
     def update_log(self, d_cond, d_update):
         if len(d_cond) == 0:
             _logger.warn("called update with empty condition")
             #raise ValueError("called update with empty condition")
+        self.flush_lines()
+        if self._catalog and \
+                len(set(d_update.keys()) & set(["ltid", "dt", "host"])) > 0:
+            # catalog of messages before and after updating
+            s_key = self._catalog_keys(d_cond)
+            self._update_log(d_cond, d_update)
+            if d_update.has_key("dt"):
+                t = self._epoch_dt(d_update["dt"])
+                new_day = t - t % 86400
+            else:
+                new_day = None
+            for day, host, ltid in list(s_key):
+                s_key.add((day if new_day is None else new_day,
+                           d_update.get("host", host),
+                           d_update.get("ltid", ltid)))
+            self._refresh_catalog(s_key)
+        else:
+            self._update_log(d_cond, d_update)
+
+    def _update_log(self, d_cond, d_update):
+        if self._ltgid_column and d_update.has_key("ltid"):
+            # ltgid of new ltid not registered yet is given
+            # later with update_log_ltgid
+            d_update = d_update.copy()
+            ltline = self.lttable.ltdict.get(d_update["ltid"])
+            d_update["ltgid"] = None if ltline is None else ltline.ltgid
+        if self._words_format == "diff":
+            d_update = d_update.copy()
+            if d_update.has_key("words"):
+                # given in plain format
+                d_update["words"] = "!" + d_update["words"]
+            elif d_update.has_key("ltid"):
+                # words are encoded with base words of the log template
+                self._update_log_ltid(d_cond, d_update)
+                return
         args = d_cond.copy()
 
-        table_name = "log"
         l_ss = []
         for k, v in d_update.iteritems():
             #assert k in ("ltid", "top_dt", "end_dt", "host")
             keyname = "update_" + k
             l_ss.append(db_common.setstate(k, keyname))
+            if k == "dt":
+                v = self._encode_dt(v)
             args[keyname] = v
-        l_cond = []
-        for c in d_cond.keys():
-            if c == "ltgid":
-                sql= self.db.select_sql("ltg", ["ltid"],
-                        [db_common.cond(c, "=", c)])
-                l_cond.append(db_common.cond("ltid", "in", sql, False))
-            elif c == "area":
-                sql= self.db.select_sql("area", ["host"],
-                        [db_common.cond(c, "=", c)])
-                l_cond.append(db_common.cond("host", "in", sql, False))
-            elif c == "top_dt":
-                l_cond.append(db_common.cond("dt", ">=", c))
-                args[c] = self.db.strftime(d_cond[c])
-            elif c == "end_dt":
-                l_cond.append(db_common.cond("dt", "<", c))
-                args[c] = self.db.strftime(d_cond[c])
-            else:
-                l_cond.append(db_common.cond(c, "=", c))
-        sql = self.db.update_sql(table_name, l_ss, l_cond)
-        self.db.execute(sql, args)
+        l_cond = self._log_cond(d_cond, args)
+        for table_name in self._cond_tables(d_cond):
+            sql = self.db.update_sql(table_name, l_ss, l_cond)
+            self.db.execute(sql, args)
 
+    def _update_log_ltid(self, d_cond, d_update):
+        for table_name in self._cond_tables(d_cond):
+            args = d_cond.copy()
+            l_key = ["lid", "ltid", "words"]
+            l_cond = self._log_cond(d_cond, args)
+            sql = self.db.select_sql(table_name, l_key, l_cond)
+            l_row = self.db.execute(sql, args).fetchall()
+
+            new_ltid = d_update["ltid"]
+            l_ss = [db_common.setstate(k, "update_" + k)
+                    for k in d_update.keys() + ["words"]]
+            l_cond = [db_common.cond("lid", "=", "lid")]
+            sql = self.db.update_sql(table_name, l_ss, l_cond)
+            l_args = []
+            for lid, ltid, words in l_row:
+                l_w = self._decode_words(int(ltid), words)
+                args = dict(("update_" + k, v)
+                            for k, v in d_update.iteritems())
+                args["update_words"] = self._encode_words(new_ltid, l_w)
+                args["lid"] = lid
+                l_args.append(args)
+            if len(l_args) > 0:
+                self.db.executemany(sql, l_args)
+
+    def convert_words_format(self, words_format, batch_size = 10000):
+        """Convert stored words of all log messages into given format
+        (plain or diff)."""
+        self.flush_lines()
+        if self._words_format == words_format:
+            return
+        elif words_format == "diff":
+            self._init_ltbase_table()
+            self._d_base = {}
+            self._words_format = "diff"
+            decode = lambda ltid, words: self._split_words(words)
+            encode = self._encode_words
+        elif words_format == "plain":
+            decode = self._decode_words
+            encode = lambda ltid, l_w: self._splitter.join(l_w)
+        else:
+            raise ValueError("invalid words_format ({0})".format(
+                    words_format))
+
+        l_key = ["lid", "ltid", "words"]
+        l_cond = [db_common.cond("lid", ">=", "top"),
+                  db_common.cond("lid", "<", "end")]
+        for table_name in self._log_tables():
+            sql_select = self.db.select_sql(table_name, l_key, l_cond)
+            sql_update = self.db.update_sql(table_name,
+                    [db_common.setstate("words", "words")],
+                    [db_common.cond("lid", "=", "lid")])
+            min_lid, max_lid = self._lid_range(table_name)
+            for top in xrange(min_lid, max_lid + 1, batch_size):
+                args = {"top" : top, "end" : top + batch_size}
+                l_row = self.db.execute(sql_select, args).fetchall()
+                l_args = []
+                for lid, ltid, words in sorted(l_row):
+                    l_w = decode(int(ltid), words)
+                    l_args.append({"lid" : lid,
+                            "words" : encode(int(ltid), l_w)})
+                if len(l_args) > 0:
+                    self.db.executemany(sql_update, l_args)
+
+        if words_format == "plain":
+            sql = self.db.drop_sql("ltbase")
+            self.db.execute(sql)
+            self._d_base = {}
+            self._words_format = "plain"
+
+    def convert_dt_format(self, dt_format, batch_size = 10000):
+        """Convert timestamps of all log messages into given format
+        (text or epoch). The log table is remade, so indexes of the table
+        should be created again after this."""
+        self.flush_lines()
+        if self._dt_format == dt_format:
+            return
+        elif dt_format == "epoch":
+            conv = lambda val: calendar.timegm(
+                    self.db.datetime(val).timetuple())
+        elif dt_format == "text":
+            conv = lambda val: self.db.strftime(
+                    datetime.datetime.utcfromtimestamp(val))
+        else:
+            raise ValueError("invalid dt_format ({0})".format(dt_format))
+
+        self._dt_format = dt_format
+        temp_table_name = "log_temp"
+        l_key = ["lid", "ltid", "dt", "host", "words"]
+        if self._ltgid_column:
+            l_key.append("ltgid")
+        l_cond = [db_common.cond("lid", ">=", "top"),
+                  db_common.cond("lid", "<", "end")]
+        sql_insert = self.db.insert_sql(temp_table_name,
+                [db_common.setstate(k, k) for k in l_key])
+        for table_name in self._log_tables():
+            self._init_log_table(temp_table_name)
+            sql_select = self.db.select_sql(table_name, l_key, l_cond)
+            min_lid, max_lid = self._lid_range(table_name)
+            for top in xrange(min_lid, max_lid + 1, batch_size):
+                args = {"top" : top, "end" : top + batch_size}
+                l_row = self.db.execute(sql_select, args).fetchall()
+                l_args = []
+                for row in l_row:
+                    args = dict(zip(l_key, row))
+                    args["dt"] = conv(args["dt"])
+                    l_args.append(args)
+                if len(l_args) > 0:
+                    self.db.executemany(sql_insert, l_args)
+            self.db.execute(self.db.drop_sql(table_name))
+            self.db.execute(self.db.rename_sql(temp_table_name, table_name))
+
+    def _lid_range(self, table_name):
+        l_key = ["min(lid)", "max(lid)"]
+        sql = self.db.select_sql(table_name, l_key)
+        min_lid, max_lid = self.db.execute(sql).fetchone()
+        if min_lid is None:
+            return 0, -1
+        else:
+            return int(min_lid), int(max_lid)
 
     def count_lines(self):
-        table_name = "log"
+        self.flush_lines()
         l_key = ["max(lid)"]
-        sql = self.db.select_sql(table_name, l_key)
-        cursor = self.db.execute(sql)
-        return int(cursor.fetchone()[0])
+        ret = None
+        for table_name in self._log_tables():
+            sql = self.db.select_sql(table_name, l_key)
+            cursor = self.db.execute(sql)
+            temp = cursor.fetchone()[0]
+            if temp is not None and (ret is None or temp > ret):
+                ret = temp
+        if ret is None:
+            # no lines in DB
+            return 0
+        else:
+            return int(ret)
 
     def dt_term(self):
-        table_name = "log"
+        self.flush_lines()
+        if self._catalog:
+            l_key = ["min(first_dt)", "max(last_dt)"]
+            sql = self.db.select_sql("catalog", l_key)
+            top, end = self.db.execute(sql).fetchone()
+            if None in (top, end):
+                raise ValueError("No data found in DB")
+            return (datetime.datetime.utcfromtimestamp(int(top)),
+                    datetime.datetime.utcfromtimestamp(int(end)))
         l_key = ["min(dt)", "max(dt)"]
-        sql = self.db.select_sql(table_name, l_key)
-        cursor = self.db.execute(sql)
-        top_dtstr, end_dtstr = cursor.fetchone()
+        top_dtstr, end_dtstr = None, None
+        for table_name in self._log_tables():
+            sql = self.db.select_sql(table_name, l_key)
+            cursor = self.db.execute(sql)
+            temp_top, temp_end = cursor.fetchone()
+            if temp_top is None:
+                continue
+            if top_dtstr is None or temp_top < top_dtstr:
+                top_dtstr = temp_top
+            if end_dtstr is None or temp_end > end_dtstr:
+                end_dtstr = temp_end
         if None in (top_dtstr, end_dtstr):
             raise ValueError("No data found in DB")
-        return self.db.datetime(top_dtstr), self.db.datetime(end_dtstr)
+        return self._decode_dt(top_dtstr), self._decode_dt(end_dtstr)
 
-    def whole_host_lt(self, top_dt = None, end_dt = None):
-        table_name = "log"
-        l_key = ["host", "ltid"]
+    def _select_term(self, l_key, top_dt, end_dt, opt = []):
+        # rows of given keys in all log tables of the term
+        self.flush_lines()
         l_cond = []
         args = {}
         if top_dt is not None:
             l_cond.append(db_common.cond("dt", ">=", "top_dt"))
-            args["top_dt"] = top_dt
+            args["top_dt"] = self._encode_dt(top_dt)
         if end_dt is not None:
             l_cond.append(db_common.cond("dt", "<", "end_dt"))
-            args["end_dt"] = end_dt
-        sql = self.db.select_sql(table_name, l_key, l_cond, opt = ["distinct"])
-        cursor = self.db.execute(sql, args)
-        return [(row[0], row[1]) for row in cursor]
-
-    def whole_host(self, top_dt = None, end_dt = None):
-        table_name = "log"
-        l_key = ["host"]
+            args["end_dt"] = self._encode_dt(end_dt)
+        for table_name in self._log_tables(top_dt, end_dt):
+            sql = self.db.select_sql(table_name, l_key, l_cond, opt = opt)
+            for row in self.db.execute(sql, args):
+                yield row
+
+    def _select_distinct(self, l_key, top_dt, end_dt):
+        # distinct rows of given keys in all log tables of the term
+        ret = []
+        s_row = set()
+        for row in self._select_term(l_key, top_dt, end_dt,
+                opt = ["distinct"]):
+            if not row in s_row:
+                s_row.add(row)
+                ret.append(row)
+        return ret
+
+    def count_host_lt(self, top_dt = None, end_dt = None):
+        self.flush_lines()
+        d_cnt = collections.defaultdict(int)
+        if not self._catalog:
+            for host, ltid in self._select_term(["host", "ltid"],
+                    top_dt, end_dt):
+                d_cnt[(host, int(ltid))] += 1
+            return dict(d_cnt)
+
+        # messages in the term are counted with catalog,
+        # and with log tables only for the days partially in the term
         l_cond = []
         args = {}
-        if top_dt is not None:
-            l_cond.append(db_common.cond("dt", ">=", "top_dt"))
-            args["top_dt"] = top_dt
-        if end_dt is not None:
-            l_cond.append(db_common.cond("dt", "<", "end_dt"))
-            args["end_dt"] = end_dt
-        sql = self.db.select_sql(table_name, l_key, l_cond, opt = ["distinct"])
-        cursor = self.db.execute(sql, args)
-        return [row[0] for row in cursor]
+        top = None if top_dt is None else self._epoch_dt(top_dt)
+        end = None if end_dt is None else self._epoch_dt(end_dt)
+        if top is not None:
+            l_cond.append(db_common.cond("day", ">", "top_day"))
+            args["top_day"] = top - 86400
+        if end is not None:
+            l_cond.append(db_common.cond("day", "<", "end"))
+            args["end"] = end
+        l_key = ["day", "host", "ltid", "count", "first_dt", "last_dt"]
+        sql = self.db.select_sql("catalog", l_key, l_cond)
+        for day, host, ltid, cnt, first, last in \
+                self.db.execute(sql, args).fetchall():
+            key = (host, int(ltid))
+            if (top is None or top <= first) and (end is None or last < end):
+                d_cnt[key] += int(cnt)
+            elif (top is not None and last < top) or \
+                    (end is not None and first >= end):
+                pass
+            else:
+                d_cond = {"ltid" : int(ltid), "host" : host,
+                        "top_dt" : datetime.datetime.utcfromtimestamp(
+                            day if top is None else max(day, top)),
+                        "end_dt" : datetime.datetime.utcfromtimestamp(
+                            day + 86400 if end is None
+                            else min(day + 86400, end))}
+                temp_cnt = sum(int(row[0]) for row
+                               in self._select_log(d_cond, ["count(*)"]))
+                if temp_cnt > 0:
+                    d_cnt[key] += temp_cnt
+        return dict(d_cnt)
+
+    def whole_host_lt(self, top_dt = None, end_dt = None):
+        if self._catalog:
+            return sorted(self.count_host_lt(top_dt, end_dt).keys())
+        return [(row[0], row[1]) for row
+                in self._select_distinct(["host", "ltid"], top_dt, end_dt)]
+
+    def whole_host(self, top_dt = None, end_dt = None):
+        if self._catalog:
+            return sorted(set(host for host, ltid
+                    in self.count_host_lt(top_dt, end_dt).keys()))
+        return [row[0] for row
+                in self._select_distinct(["host"], top_dt, end_dt)]
 
     def add_lt(self, ltline):
         table_name = "lt"
@@ -721,6 +1605,20 @@ class LogDB():
         sql = self.db.update_sql(table_name, l_ss, l_cond)
         self.db.execute(sql, args)
 
+    def update_lt_count(self, l_count):
+        """Update counts of multiple log templates with 1 statement.
+
+        Args:
+            l_count (List[Tuple[int, int]]): Pairs of ltid and count.
+        """
+        table_name = "lt"
+        l_ss = [db_common.setstate("count", "count")]
+        l_cond = [db_common.cond("ltid", "=", "ltid")]
+        sql = self.db.update_sql(table_name, l_ss, l_cond)
+        l_args = [{"ltid" : ltid, "count" : count}
+                  for ltid, count in l_count]
+        self.db.executemany(sql, l_args)
+
     def remove_lt(self, ltid):
         args = {"ltid" : ltid}
 
@@ -799,6 +1697,126 @@ class LogDB():
         sql = self.db.delete_sql("ltg")
         self.db.execute(sql)
 
+    def reset_lt(self):
+        for table_name in ("lt", "ltg"):
+            sql = self.db.delete_sql(table_name)
+            self.db.execute(sql)
+
+    def remove_lines_after(self, lid):
+        """Remove log messages with larger lid than given one,
+        and make next inserted message to have lid + 1."""
+        self.flush_lines()
+        l_cond = [db_common.cond("lid", ">", "lid")]
+        args = {"lid" : lid}
+        s_key = set()
+        for table_name in self._log_tables():
+            if self._catalog:
+                sql = self.db.select_sql(table_name,
+                        ["dt", "host", "ltid"], l_cond)
+                for dt, host, ltid in self.db.execute(sql, args):
+                    t = self._epoch(dt)
+                    s_key.add((t - t % 86400, host, int(ltid)))
+            sql = self.db.delete_sql(table_name, l_cond)
+            self.db.execute(sql, args)
+        if self._catalog:
+            self._refresh_catalog(s_key)
+        if self._partition == "none":
+            self.db.set_autoincrement("log", lid)
+        else:
+            self._line_cnt = lid
+
+    def remove_lines_before(self, dt):
+        """Remove log messages before given datetime.
+        In partitioned DB, tables of the partitions that end
+        before dt are dropped, instead of deleting messages.
+
+        Returns:
+            dict: Number of removed messages for each ltid.
+        """
+        self.flush_lines()
+        d_cnt = collections.defaultdict(int)
+        for table_name in self._log_tables(end_dt = dt):
+            if self._partition == "none" or \
+                    self._part_term(table_name[4:])[1] > dt:
+                l_cond = [db_common.cond("dt", "<", "end_dt")]
+                args = {"end_dt" : self._encode_dt(dt)}
+            else:
+                l_cond = []
+                args = {}
+            sql = self.db.select_sql(table_name, ["ltid"], l_cond)
+            for row in self.db.execute(sql, args):
+                d_cnt[int(row[0])] += 1
+            if len(l_cond) == 0:
+                self.db.execute(self.db.drop_sql(table_name))
+                self._l_part.remove(table_name[4:])
+            else:
+                sql = self.db.delete_sql(table_name, l_cond)
+                self.db.execute(sql, args)
+        if self._catalog:
+            t = self._epoch_dt(dt)
+            day = t - t % 86400
+            sql = self.db.delete_sql("catalog",
+                    [db_common.cond("day", "<", "day")])
+            self.db.execute(sql, {"day" : day})
+            if t > day:
+                # messages of the day of dt are partially removed
+                sql = self.db.select_sql("catalog",
+                        ["day", "host", "ltid"],
+                        [db_common.cond("day", "=", "day")])
+                s_key = set((int(row[0]), row[1], int(row[2])) for row
+                        in self.db.execute(sql, {"day" : day}).fetchall())
+                self._refresh_catalog(s_key)
+        return d_cnt
+
+    def _init_checkpoint_table(self):
+        table_name = "checkpoint"
+        l_key = [db_common.tablekey("cid", "integer", ("primary_key",)),
+                 db_common.tablekey("seq", "integer"),
+                 db_common.tablekey("fid", "integer"),
+                 db_common.tablekey("path", "text"),
+                 db_common.tablekey("pos", "integer"),
+                 db_common.tablekey("lid", "integer")]
+        sql = self.db.create_table_sql(table_name, l_key)
+        self.db.execute(sql)
+
+    def set_checkpoint(self, seq, fid, path, pos, lid):
+        """Record a checkpoint of processing source files.
+        It is fixed with the log messages and templates
+        in the same commit."""
+        table_name = "checkpoint"
+        if not table_name in self.db.get_table_names():
+            self._init_checkpoint_table()
+        else:
+            sql = self.db.delete_sql(table_name)
+            self.db.execute(sql)
+        l_ss = [db_common.setstate(k, k)
+                for k in ("cid", "seq", "fid", "path", "pos", "lid")]
+        args = {"cid" : 0, "seq" : seq, "fid" : fid, "path" : path,
+                "pos" : pos, "lid" : lid}
+        sql = self.db.insert_sql(table_name, l_ss)
+        self.db.execute(sql, args)
+
+    def get_checkpoint(self):
+        """Return the last recorded checkpoint as a tuple
+        (seq, fid, path, pos, lid), or None if not found."""
+        table_name = "checkpoint"
+        if not table_name in self.db.get_table_names():
+            return None
+        l_key = ["seq", "fid", "path", "pos", "lid"]
+        sql = self.db.select_sql(table_name, l_key)
+        cursor = self.db.execute(sql)
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        seq, fid, path, pos, lid = row
+        return int(seq), int(fid), path, int(pos), int(lid)
+
+    def clear_checkpoint(self):
+        table_name = "checkpoint"
+        if table_name in self.db.get_table_names():
+            sql = self.db.delete_sql(table_name)
+            self.db.execute(sql)
+
     def _init_area(self):
         if self.areafn is None or self.areafn == "":
             return
@@ -814,6 +1832,15 @@ class LogDB():
             }
             self.db.execute(sql, args)
         self.commit()
+        self._d_area = None
+
+    def _area_map(self):
+        if self._d_area is None:
+            self._d_area = {}
+            sql = self.db.select_sql("area", ["host", "area"])
+            for host, area in self.db.execute(sql):
+                self._d_area.setdefault(area, set()).add(host)
+        return self._d_area
 
     def host_area(self, host):
         table_name = area
@@ -825,8 +1852,38 @@ class LogDB():
         return [row[0] for row in cursor]
 
 
-def _iter_line_from_files(targets):
-    for fp in targets:
+def init_shared(conf):
+    """Load log templates and other data of DB to read messages,
+    and share them with LogData instances in readonly mode
+    (edit = False) made after this call, instead of loading them
+    for each instance. Child processes forked after this call
+    (e.g., with multiprocessing) also use them without loading.
+    The DB should not be edited while using shared data.
+
+    Args:
+        conf (config.ExtendedConfigParser): A common configuration object.
+
+    Returns:
+        LogData: A readonly instance used to load data.
+    """
+    ld = LogData(conf)
+    _d_shared[ld.db.key] = ld.db._dump_shared()
+    return ld
+
+
+def clear_shared():
+    """Remove data shared with init_shared."""
+    _d_shared.clear()
+
+
+def _iter_line_from_files(targets, mmap_size = 0, start = (0, 0)):
+    """Yields tuple: The position after the line (file index in targets
+    and byte offset in the file), and the line.
+    Reading starts from the position given as start."""
+    start_fid, start_offset = start
+    for fid, fp in enumerate(targets):
+        if fid < start_fid:
+            continue
         if os.path.isdir(fp):
             sys.stderr.write(
                     "{0} is a directory, fail to process\n".format(fp))
@@ -835,10 +1892,39 @@ def _iter_line_from_files(targets):
         else:
             if not os.path.isfile(fp):
                 raise IOError("File {0} not found".format(fp))
-            with open(fp, 'r') as f:
-                _logger.info("log_db processing file {0}".format(fp))
-                for line in f:
-                    yield line
+            _logger.info("log_db processing file {0}".format(fp))
+            offset = start_offset if fid == start_fid else 0
+            for line in common.iter_lines(fp, mmap_size, offset):
+                offset += len(line)
+                yield (fid, offset), line
+
+
+def parse_line(msg, lp, ha, drop_undefhost = False):
+    """Parse a log message into the values to be classified and stored.
+    This function does not use any state of DB or template classifier,
+    so it can be processed in separated processes.
+
+    Args:
+        msg (str): A log message to process.
+        lp (logparser.LogParser): An open message parser.
+        ha (host_alias.HostAlias): A host alias definition.
+        drop_undefhost (Optional[bool]): If True, hosts not defined in
+            host alias definition are given as None.
+
+    Returns:
+        tuple: dt, host, l_w, l_s.
+            l_w is None if the message should be ignored.
+            host is None if the message is from an undefined host
+            and drop_undefhost is True.
+    """
+    dt, org_host, l_w, l_s = lp.process_line(msg)
+    if l_w is None: return dt, None, None, None
+    l_w = [strutil.add_esc(w) for w in l_w]
+    host = ha.resolve_host(org_host)
+    #if host is None: host = org_host
+    if host is None and not drop_undefhost:
+        host = org_host
+    return dt, host, l_w, l_s
 
 
 def process_line(msg, ld, lp, ha, isnew_check = False, latest = None,
@@ -858,21 +1944,32 @@ def process_line(msg, ld, lp, ha, isnew_check = False, latest = None,
         LogMessage: An annotated log message instance.
             Same as lines given with LogData.iterlines.
     """
+    parsed = parse_line(msg, lp, ha, drop_undefhost)
+    return process_parsed_line(msg, parsed, ld, latest)
+
+
+def process_parsed_line(msg, parsed, ld, latest = None):
+    """Classify a log message parsed with parse_line, and add it to DB.
+
+    Args:
+        msg (str): The original log message, used for failure output.
+        parsed (tuple): dt, host, l_w, l_s given by parse_line.
+        ld (LogData): An log database interface opened in edit mode.
+        latest (Optional[datetime.datetime]): If not None,
+            Ignore messages that have later timestamp than 'latest'.
+
+    Returns:
+        LogMessage: An annotated log message instance.
+    """
     line = None
 
-    dt, org_host, l_w, l_s = lp.process_line(msg)
+    dt, host, l_w, l_s = parsed
     if latest is not None and dt < latest: return None
     if l_w is None: return None
-    l_w = [strutil.add_esc(w) for w in l_w]
-    host = ha.resolve_host(org_host)
-    #if host is None: host = org_host
     if host is None:
         #if conf.getboolean("database", "undefined_host"):
-        if drop_undefhost:
-            ld.ltm.failure_output(msg)
-            return None
-        else:
-            host = org_host
+        ld.ltm.failure_output(msg)
+        return None
 
     _logger.debug("Processing [{0}]".format(" ".join(l_w)))
     ltline = ld.ltm.process_line(l_w, l_s)
@@ -885,7 +1982,166 @@ def process_line(msg, ld, lp, ha, isnew_check = False, latest = None,
     return line
 
 
-def process_files(conf, targets, reset_db, isnew_check = False):
+_mp_parser = None # LogParser, HostAlias and options in worker processes
+
+
+def _init_parse_worker(conf, drop_undefhost):
+    global _mp_parser
+    _mp_parser = (logparser.LogParser(conf), host_alias.HostAlias(conf),
+            drop_undefhost)
+
+
+def _parse_worker(l_msg):
+    lp, ha, drop_undefhost = _mp_parser
+    return [parse_line(msg, lp, ha, drop_undefhost) for msg in l_msg]
+
+
+def _iter_chunk(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def iter_parsed_lines(conf, targets, pal = 1, chunk_size = 1000,
+        start = None):
+    """Generate raw log messages in files with their parsed values
+    (given by parse_line), keeping the order in files.
+
+    Args:
+        conf (config.ExtendedConfigParser): A common configuration object.
+        targets (List[str]): A sequence of filepaths to process.
+        pal (Optional[int]): Number of processes to parse messages.
+            If 1, messages are parsed in this process.
+        chunk_size (Optional[int]): Number of messages
+            given to a worker process at once.
+        start (Optional[Tuple[int, int]]): If given, start reading
+            from this position (file index in targets and byte offset),
+            and yield positions of messages together.
+
+    Yields:
+        tuple: A raw log message and the parsed tuple (dt, host, l_w, l_s).
+            If start is given, the position after the message
+            (file index and byte offset) is added at first.
+    """
+    drop_undefhost = conf.getboolean("database", "undefined_host")
+    mmap_size = conf.getint("general", "src_mmap_size")
+    if start is None:
+        with_pos = False
+        start = (0, 0)
+    else:
+        with_pos = True
+    iterable = _iter_line_from_files(targets, mmap_size, start)
+
+    if pal <= 1:
+        lp = logparser.LogParser(conf)
+        ha = host_alias.HostAlias(conf)
+        for pos, msg in iterable:
+            parsed = parse_line(msg, lp, ha, drop_undefhost)
+            if with_pos:
+                yield pos, msg, parsed
+            else:
+                yield msg, parsed
+        _logger.info(lp.cache_stat())
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(pal, _init_parse_worker,
+            (conf, drop_undefhost))
+    try:
+        # keep some chunks in process to make workers busy,
+        # and take results in the order of input
+        queue = collections.deque()
+        for chunk in _iter_chunk(iterable, chunk_size):
+            l_msg = [msg for pos, msg in chunk]
+            queue.append((chunk, pool.apply_async(_parse_worker, (l_msg,))))
+            if len(queue) > 2 * pal:
+                chunk, result = queue.popleft()
+                for (pos, msg), parsed in zip(chunk, result.get()):
+                    if with_pos:
+                        yield pos, msg, parsed
+                    else:
+                        yield msg, parsed
+        while len(queue) > 0:
+            chunk, result = queue.popleft()
+            for (pos, msg), parsed in zip(chunk, result.get()):
+                if with_pos:
+                    yield pos, msg, parsed
+                else:
+                    yield msg, parsed
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _checkpoint_filename(conf, seq):
+    # keep 2 files alternately, not to break the one
+    # referred by the committed checkpoint
+    return "{0}.ckpt{1}".format(
+            conf.get("log_template", "indata_filename"), seq % 2)
+
+
+def _checkpoint(ld, targets, pos, seq):
+    """Commit DB with a checkpoint record and the template
+    generator state at the given position of source files."""
+    fid, offset = pos
+    path = targets[fid] if fid < len(targets) else ""
+    l_lt = [(ltline.ltid, ltline.ltgid, ltline.ltw, ltline.lts, ltline.cnt)
+            for ltline in ld.lttable]
+    fn = _checkpoint_filename(ld.conf, seq)
+    with open(fn, "wb") as f:
+        pickle.dump((ld.ltm.dumpobj(), l_lt), f)
+        f.flush()
+        os.fsync(f.fileno())
+    ld.db.set_checkpoint(seq, fid, path, offset, ld.db.count_lines())
+    ld.ltm.flush_count()
+    ld.db.commit()
+    _logger.debug("checkpoint {0} at {1}:{2}".format(seq, path, offset))
+
+
+def _restore_checkpoint(ld, targets):
+    """Remove log messages and templates added after the last checkpoint
+    in DB, and restore template generator state of the checkpoint.
+    Call this before LogData.init_ltmanager.
+
+    Returns:
+        tuple: The position (file index and byte offset) to restart,
+            and the sequence number of the checkpoint.
+    """
+    ckpt = ld.db.get_checkpoint()
+    if ckpt is None:
+        raise ValueError("no checkpoint found in DB, failed to resume")
+    seq, fid, path, offset, lid = ckpt
+    if not path == "" and not (fid < len(targets) and targets[fid] == path):
+        raise ValueError(
+                "given files differ from checkpoint ({0})".format(path))
+    with open(_checkpoint_filename(ld.conf, seq), "rb") as f:
+        ltm_data, l_lt = pickle.load(f)
+
+    ld.db.remove_lines_after(lid)
+    ld.db.reset_lt()
+    ld.lttable.ltdict = {}
+    for ltid, ltgid, ltw, lts, cnt in l_lt:
+        ld.lttable.restore_lt(ltid, ltgid, ltw, lts, cnt)
+        ld.db.add_lt(ld.lttable[ltid])
+    ld.db.commit()
+    # template generator loads this in init_ltmanager
+    with open(ld.conf.get("log_template", "indata_filename"), "wb") as f:
+        pickle.dump(ltm_data, f)
+    _logger.info("resume from checkpoint {0} ({1}:{2}, lid {3})".format(
+            seq, path, offset, lid))
+    return (fid, offset), seq
+
+
+def process_files(conf, targets, reset_db, isnew_check = False, pal = 1,
+        resume = False):
     """Add log messages to DB from files.
 
     Args:
@@ -895,72 +2151,197 @@ def process_files(conf, targets, reset_db, isnew_check = False):
             False otherwise. 
         isnew_check (Optional[bool]): If True, add message to DB
             only if its timestamp is newest of existing messages in DB.
+        pal (Optional[int]): Number of processes to parse messages.
+            Template classification and DB insertion are
+            processed in this process.
+        resume (Optional[bool]): If True, restart interrupted processing
+            from the last checkpoint in DB (reset_db is ignored).
+            Give same targets as the interrupted processing.
 
     Raises:
         IOError: If a file in targets not found.
     """
-    ld = LogData(conf, edit = True, reset_db = reset_db)
-    ld.init_ltmanager()
-    lp = logparser.LogParser(conf)
-    ha = host_alias.HostAlias(conf)
+    import log_follow
+    ckpt_interval = conf.getint("database", "checkpoint_interval")
+    bulk_load = conf.getboolean("database", "bulk_load")
+    if resume:
+        ld = LogData(conf, edit = True)
+        start, seq = _restore_checkpoint(ld, targets)
+        ld.init_ltmanager()
+    else:
+        ld = LogData(conf, edit = True, reset_db = reset_db,
+                defer_index = bulk_load)
+        ld.init_ltmanager()
+        if reset_db:
+            common.rm(log_follow.state_filename(conf))
+        start, seq = (0, 0), 0
+        if ckpt_interval > 0:
+            _checkpoint(ld, targets, start, seq)
     latest = ld.dt_term()[1] if isnew_check else None
-    drop_undefhost = conf.getboolean("database", "undefined_host")
-
-    for line in _iter_line_from_files(targets):
-        process_line(line, ld, lp, ha, isnew_check, latest, drop_undefhost)
 
+    d_offset = {}
+    try:
+        cnt = 0
+        for pos, msg, parsed in iter_parsed_lines(conf, targets, pal,
+                start = start):
+            process_parsed_line(msg, parsed, ld, latest)
+            d_offset[targets[pos[0]]] = pos[1]
+            cnt += 1
+            if ckpt_interval > 0 and cnt % ckpt_interval == 0:
+                seq += 1
+                _checkpoint(ld, targets, pos, seq)
+    except:
+        # keep messages processed before the error
+        ld.db.flush_lines()
+        ld.ltm.flush_count()
+        raise
+    _logger.info(ld.ltm.cache_stat())
+
+    if ckpt_interval > 0 or resume:
+        ld.db.clear_checkpoint()
+    if bulk_load:
+        ld.db.create_index()
     ld.commit_db()
+    # log_db follow starts reading after the added lines
+    log_follow.record_files(conf, targets, d_offset)
+    if ckpt_interval > 0 or resume:
+        for i in range(2):
+            common.rm(_checkpoint_filename(conf, i))
+
 
+class _InitDataBuffer():
+    """Parsed log messages stored for process_init_data.
+    Messages are kept on memory up to given size, and spilled into
+    a temporal file over it, so that used memory does not depend on
+    the size of data. This object can be iterated multiple times.
 
-def process_init_data(conf, targets, isnew_check = False):
+    Attributes:
+        size (int): Maximum number of messages on memory.
+            If 0 or less, all messages are kept on memory.
+        dirname (str): Directory to make the temporal file.
+            If None, use default temporal directory.
+        spill_cnt (int): Number of messages in the temporal file.
+    """
+
+    def __init__(self, size, dirname = None):
+        self.size = size
+        self.dirname = dirname
+        self._l_buf = []
+        self._spill_fn = None
+        self.spill_cnt = 0
+
+    def __len__(self):
+        return self.spill_cnt + len(self._l_buf)
+
+    def __iter__(self):
+        for dt, host, l_w, l_s in self.iter_data():
+            yield l_w, l_s
+
+    def append(self, dt, host, l_w, l_s):
+        self._l_buf.append((dt, host, l_w, l_s))
+        if self.size > 0 and len(self._l_buf) >= self.size:
+            self._spill()
+
+    def _spill(self):
+        # records are written with marshal (faster than pickle),
+        # that does not support datetime
+        import marshal
+        import tempfile
+        if self._spill_fn is None:
+            fd, self._spill_fn = tempfile.mkstemp(prefix = "log_db_init_",
+                    dir = self.dirname)
+            os.close(fd)
+        with open(self._spill_fn, "ab") as f:
+            for dt, host, l_w, l_s in self._l_buf:
+                t_dt = (dt.year, dt.month, dt.day, dt.hour,
+                        dt.minute, dt.second, dt.microsecond)
+                marshal.dump((t_dt, host, l_w, l_s), f)
+        self.spill_cnt += len(self._l_buf)
+        self._l_buf = []
+
+    def iter_data(self):
+        """Yields tuple: dt, host, l_w, l_s of stored messages."""
+        if self._spill_fn is not None:
+            import marshal
+            with open(self._spill_fn, "rb") as f:
+                for i in xrange(self.spill_cnt):
+                    t_dt, host, l_w, l_s = marshal.load(f)
+                    yield datetime.datetime(*t_dt), host, l_w, l_s
+        for data in self._l_buf:
+            yield data
+
+    def close(self):
+        """Remove the temporal file."""
+        if self._spill_fn is not None:
+            common.rm(self._spill_fn)
+            self._spill_fn = None
+        self.spill_cnt = 0
+        self._l_buf = []
+
+
+def process_init_data(conf, targets, isnew_check = False, pal = 1):
     """Add log messages to DB from files. This function do NOT process
     messages incrementally. Use this to avoid bad-start problem of
     log template generation with clustering or training methods.
 
     Note:
-        This function needs large memory space.
+        Parsed messages over database.init_buffer_size are
+        stored in a temporal file until all messages are classified.
 
     Args:
         conf (config.ExtendedConfigParser): A common configuration object.
         targets (List[str]): A sequence of filepaths to process.
         isnew_check (Optional[bool]): If True, add message to DB
             only if its timestamp is newest of existing messages in DB.
+        pal (Optional[int]): Number of processes to parse messages.
 
     Raises:
         IOError: If a file in targets not found.
     """
-    ld = LogData(conf, edit = True, reset_db = True)
+    import log_follow
+    bulk_load = conf.getboolean("database", "bulk_load")
+    ld = LogData(conf, edit = True, reset_db = True, defer_index = bulk_load)
     ld.init_ltmanager()
-    lp = logparser.LogParser(conf)
-    ha = host_alias.HostAlias(conf)
+    common.rm(log_follow.state_filename(conf))
     latest = ld.dt_term()[1] if isnew_check else None
-    drop_undefhost = conf.getboolean("database", "undefined_host")
 
-    l_line = []
-    l_data = []
-    for line in _iter_line_from_files(targets):
-        dt, org_host, l_w, l_s = lp.process_line(line)
-        if latest is not None and dt < latest: continue
-        if l_w is None: continue
-        l_w = [strutil.add_esc(w) for w in l_w]
-        host = ha.resolve_host(org_host)
-        if host is None:
-            if drop_undefhost:
+    spill_dir = conf.get("database", "init_spill_dir")
+    if spill_dir == "":
+        spill_dir = None
+    buf = _InitDataBuffer(conf.getint("database", "init_buffer_size"),
+            spill_dir)
+    d_offset = {}
+    try:
+        for pos, msg, parsed in iter_parsed_lines(conf, targets, pal,
+                start = (0, 0)):
+            d_offset[targets[pos[0]]] = pos[1]
+            dt, host, l_w, l_s = parsed
+            if latest is not None and dt < latest: continue
+            if l_w is None: continue
+            if host is None:
                 ld.ltm.failure_output(msg)
-                return None
-            else:
-                host = org_host
-
-        l_line.append((l_w, l_s))
-        l_data.append((dt, host))
-
-    for ltline, line, data in zip(ld.ltm.process_init_data(l_line),
-                                  l_line, l_data):
-        l_w, l_s = line
-        dt, host = data
-        ld.add_line(ltline.ltid, dt, host, l_w)
-
+                continue
+            buf.append(dt, host, l_w, l_s)
+        _logger.info("{0} messages parsed ({1} in temporal file)".format(
+                len(buf), buf.spill_cnt))
+
+        try:
+            for ltline, data in itertools.izip(
+                    ld.ltm.process_init_data(buf), buf.iter_data()):
+                dt, host, l_w, l_s = data
+                ld.add_line(ltline.ltid, dt, host, l_w)
+        except:
+            # keep messages processed before the error
+            ld.db.flush_lines()
+            ld.ltm.flush_count()
+            raise
+    finally:
+        buf.close()
+
+    if bulk_load:
+        ld.db.create_index()
     ld.commit_db()
+    log_follow.record_files(conf, targets, d_offset)
 
 
 def info(conf):
@@ -981,17 +2362,12 @@ def info(conf):
 
 
 def info_term(conf, top_dt, end_dt):
-    cnt_line = 0
-    s_ltid = set()
-    s_gid = set()
-    s_host = set()
-
     ld = LogData(conf)
-    for line in ld.iter_lines(top_dt = top_dt, end_dt = end_dt):
-        cnt_line += 1
-        s_ltid.add(line.lt.ltid)
-        s_gid.add(line.lt.ltgid)
-        s_host.add(line.host)
+    d_cnt = ld.count_host_lt(top_dt = top_dt, end_dt = end_dt)
+    cnt_line = sum(d_cnt.values())
+    s_ltid = set(ltid for host, ltid in d_cnt.keys())
+    s_gid = set(ld.ltgid_from_ltid(ltid) for ltid in s_ltid)
+    s_host = set(host for host, ltid in d_cnt.keys())
 
     print("[DB status] in {0} - {1}".format(top_dt, end_dt))
     print("Registered log lines : {0}".format(cnt_line))
@@ -1034,8 +2410,14 @@ def show_all_host(conf, top_dt = None, end_dt = None):
 
 def migrate(conf):
     ld = LogData(conf, edit = True)
-    ld.db._init_index()
+    ld.db.convert_dt_format(conf.get("database", "dt_format"))
+    if conf.getboolean("database", "log_ltgid_column"):
+        ld.db.add_ltgid_column()
+    if conf.getboolean("database", "log_catalog"):
+        ld.db.build_catalog()
+    ld.db.create_index()
     ld.update_area()
+    ld.db.convert_words_format(conf.get("database", "words_format"))
     ld.commit_db()
     
 
@@ -1053,6 +2435,13 @@ def remake_area(conf):
     ld.commit_db()
 
 
+def remove_before(conf, dt):
+    ld = LogData(conf, edit = True)
+    cnt = ld.remove_lines_before(dt)
+    ld.commit_db()
+    _logger.info("{0} messages before {1} removed".format(cnt, dt))
+
+
 def anonymize(conf):
     ld = LogData(conf, edit = True)
     d_cond = {}
@@ -1084,9 +2473,13 @@ args:
   make FILES : initialize DB and add log data in FILES
   add FILES : add all log data in FILES to existing DB
   update FILES : add newer log data found in FILES to existing DB
+  follow [FILES] : keep adding log data appended to FILES to existing DB
+                   (until interrupted, FILES can be rotated)
   info : show abstruction of DB status
   show-lt : show all log templates in DB
   remake-area : reconstruct area definiton of hosts in DB
+  remove-before DATE : remove log data before DATE (%Y-%m-%d) from DB
+                       (drop whole tables if log_partition is used)
   remake-ltgroup : Remake ltgroup definition for existing log templates.
                    Ltgroups made with this process will be usually
                    different from that with incremental processing.
@@ -1099,6 +2492,11 @@ args:
             help="configuration file path")
     op.add_option("-r", action="store_true", dest="recur",
             default=False, help="search log file recursively")
+    op.add_option("-p", "--parallel", action="store", dest="pal", type="int",
+            default=1, help="multiprocessing for parsing messages in make and add")
+    op.add_option("--resume", action="store_true", dest="resume",
+            default=False,
+            help="restart interrupted make or add from the last checkpoint")
     op.add_option("--debug", action="store_true", dest="debug",
             default=False, help="set logging level to DEBUG")
     options, args = op.parse_args()
@@ -1106,7 +2504,8 @@ args:
     conf = config.open_config(options.conf)
     lv = logging.DEBUG if options.debug else logging.INFO
     config.set_common_logging(conf, _logger, 
-            ["lt_common", "lt_shiso", "lt_va", "lt_import"], lv = lv)
+            ["lt_common", "lt_shiso", "lt_va", "lt_import",
+            "log_follow"], lv = lv)
 
     if len(args) == 0:
         sys.exit(usage)
@@ -1115,13 +2514,14 @@ args:
         targets = _get_targets(conf, args, options.recur)
         timer = common.Timer("log_db make", output = _logger)
         timer.start()
-        process_files(conf, targets, True)
+        process_files(conf, targets, True, pal = options.pal,
+                resume = options.resume)
         timer.stop()
     elif mode == "make-init":
         targets = _get_targets(conf, args, options.recur)
         timer = common.Timer("log_db make-init", output = _logger)
         timer.start()
-        process_init_data(conf, targets)
+        process_init_data(conf, targets, pal = options.pal)
         timer.stop()
     elif mode == "add":
         if len(args) == 0:
@@ -1133,7 +2533,8 @@ args:
                 targets = common.rep_dir(args)
         timer = common.Timer("log_db add", output = _logger)
         timer.start()
-        process_files(conf, targets, False)
+        process_files(conf, targets, False, pal = options.pal,
+                resume = options.resume)
         timer.stop()
     elif mode == "update":
         if len(args) == 0:
@@ -1147,6 +2548,13 @@ args:
         timer.start()
         process_files(conf, targets, False, diff = True)
         timer.stop()
+    elif mode == "follow":
+        import log_follow
+        if len(args) == 0:
+            l_path = conf.getlist("general", "src_path")
+        else:
+            l_path = args
+        log_follow.follow(conf, l_path, options.recur)
     elif mode == "info":
         info(conf)
     elif mode == "info-term":
@@ -1171,6 +2579,11 @@ args:
         show_all_host(conf)
     elif mode == "remake-area":
         remake_area(conf)
+    elif mode == "remove-before":
+        if len(args) < 1:
+            sys.exit("give me a date string")
+        dt = datetime.datetime.strptime(args[0], "%Y-%m-%d")
+        remove_before(conf, dt)
     elif mode == "remake-ltgroup":
         remake_ltgroup(conf)
     elif mode == "migrate":
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Add log messages to DB incrementally, following files
+that are appended by syslog daemons (like tail -F).
+
+Byte offsets of the processed files are recorded in a file
+after every commit of DB, so restarted processes do not read
+already registered messages again.
+Files added to DB with log_db make/add are also recorded,
+so they are followed from the end of the added lines.
+Rotated files (renamed or truncated) are detected with inode, size
+and bytes at the head of the files.
+Compressed files (e.g. rotated with compression) are not followed.
+"""
+
+import os
+import time
+import signal
+import cPickle as pickle
+import logging
+
+import common
+import log_db
+import logparser
+import host_alias
+
+_logger = logging.getLogger(__name__.rpartition(".")[-1])
+
+# bytes at the head of files recorded to identify them with inode
+_HEAD_SIZE = 128
+
+
+class FileFollower():
+    """Read lines appended to a file.
+
+    Attributes:
+        fp (str): A file path.
+        inode (int): The inode of the file being read.
+        offset (int): Byte offset of the next line to read.
+            Given by the caller after processing the lines.
+        head (str): Bytes at the head of the file, to distinguish
+            a new file that reuses the inode of a removed file.
+        l_rotated (List[Tuple[int, int, str]]): Inodes, offsets and
+            head bytes of rotated files that are read to the end.
+    """
+
+    def __init__(self, fp, inode = None, offset = 0, head = ""):
+        self.fp = fp
+        self.inode = inode
+        self.offset = offset
+        self.head = head
+        self.l_rotated = []
+        self._f = None
+
+    def _open(self):
+        try:
+            f = open(self.fp, "rb")
+        except IOError:
+            return False
+        st = os.fstat(f.fileno())
+        head = f.read(_HEAD_SIZE)
+        if self.inode != st.st_ino or st.st_size < self.offset or \
+                not head.startswith(self.head):
+            if self.inode is not None:
+                _logger.info("{0} is rotated, read from head".format(
+                        self.fp))
+            self.inode = st.st_ino
+            self.offset = 0
+        self.head = head
+        self._f = f
+        return True
+
+    def _read(self):
+        # yield completed lines, a line without line feed is left
+        # to be read after the writer completes it
+        offset = self.offset
+        self._f.seek(offset) # clear EOF state of previous reading
+        for line in self._f:
+            if not line.endswith("\n"):
+                break
+            offset += len(line)
+            yield line, offset
+
+    def _rotated(self):
+        try:
+            st = os.stat(self.fp)
+        except OSError:
+            return False
+        return not st.st_ino == self.inode or st.st_size < self.offset
+
+    def iter_lines(self):
+        """Yields tuple: A line appended after the last call,
+        and the byte offset after the line.
+        Set the offset to attribute offset after processing the line,
+        otherwise the line is read again in the next call."""
+        if self._f is None:
+            if not self._open():
+                return
+        for line, offset in self._read():
+            yield line, offset
+        if self._rotated():
+            # remaining lines in old file are already read above
+            self.l_rotated.append(self.state())
+            self.close()
+            if self._open():
+                for line, offset in self._read():
+                    yield line, offset
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def state(self):
+        if self._f is not None and len(self.head) < _HEAD_SIZE:
+            # the file was shorter than _HEAD_SIZE when opened
+            self._f.seek(0)
+            self.head = self._f.read(_HEAD_SIZE)
+        return (self.inode, self.offset, self.head)
+
+
+class FollowState():
+    """Byte offsets of followed files, saved next to DB."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._d_state = {} # key : filepath, val : (inode, offset, head)
+        self._d_rotated = {} # key : inode, val : (offset, head)
+        if os.path.exists(fn):
+            with open(fn, "rb") as f:
+                self._d_state, self._d_rotated = pickle.load(f)
+
+    def get(self, fp, inode):
+        """Return inode, offset and head bytes to start reading given file.
+        A file renamed in rotation is read from the recorded offset
+        of the inode. The offset is used only if the head bytes
+        of the file are same as recorded (checked in FileFollower)."""
+        saved = self._d_state.get(fp, (None, 0, ""))
+        if inode is not None and not saved[0] == inode:
+            if self._d_rotated.has_key(inode):
+                offset, head = self._d_rotated[inode]
+                return inode, offset, head
+            for temp in self._d_state.values():
+                if temp[0] == inode:
+                    return temp
+        return saved
+
+    def set(self, fp, inode, offset, head):
+        self._d_state[fp] = (inode, offset, head)
+
+    def update(self, l_follower):
+        for follower in l_follower:
+            self._d_state[follower.fp] = follower.state()
+            for inode, offset, head in follower.l_rotated:
+                self._d_rotated[inode] = (offset, head)
+            follower.l_rotated = []
+
+    def prune(self, s_inode, s_fp):
+        """Remove records of files that no longer exist.
+
+        Args:
+            s_inode (Set[int]): Inodes of existing files in followed paths.
+            s_fp (Set[str]): Filepaths currently followed.
+        """
+        for inode in self._d_rotated.keys():
+            if not inode in s_inode:
+                del self._d_rotated[inode]
+        for fp in self._d_state.keys():
+            if not fp in s_fp and not os.path.exists(fp):
+                del self._d_state[fp]
+
+    def dump(self):
+        # write to a temporal file and rename it,
+        # not to break recorded offsets in crashing
+        temp_fn = self.fn + ".temp"
+        with open(temp_fn, "wb") as f:
+            pickle.dump((self._d_state, self._d_rotated), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_fn, self.fn)
+
+
+def state_filename(conf):
+    fn = conf.get("database", "follow_state_filename")
+    if fn is None or fn == "":
+        if conf.get("database", "database") == "sqlite3":
+            fn = conf.get("database", "sqlite3_filename") + ".follow"
+        else:
+            fn = "log_db.follow"
+    return fn
+
+
+def record_files(conf, targets, d_offset):
+    """Record byte offsets of files added to DB with log_db make/add,
+    so that log_db follow does not read the added lines again.
+
+    Args:
+        conf (config.ExtendedConfigParser): A common configuration object.
+        targets (List[str]): Processed files.
+        d_offset (Dict[str, int]): Byte offsets where the processing
+            stopped in the files. Files not given are regarded as
+            processed to the end.
+    """
+    state = FollowState(state_filename(conf))
+    for fp in targets:
+        if os.path.isdir(fp) or common.compressed_type(fp) is not None:
+            continue
+        with open(fp, "rb") as f:
+            st = os.fstat(f.fileno())
+            head = f.read(_HEAD_SIZE)
+        state.set(fp, st.st_ino, d_offset.get(fp, st.st_size), head)
+    state.dump()
+
+
+def follow(conf, l_path, recur = False):
+    """Add log messages in given files to DB continuously,
+    until the process is interrupted (with SIGINT or SIGTERM).
+
+    Args:
+        conf (config.ExtendedConfigParser): A common configuration object.
+        l_path (List[str]): Files or directories to follow.
+            Files newly added in the directories are also followed.
+        recur (Optional[bool]): Search files in directories recursively.
+    """
+    interval = conf.getfloat("database", "follow_interval")
+    commit_interval = conf.getfloat("database", "follow_commit_interval")
+    drop_undefhost = conf.getboolean("database", "undefined_host")
+
+    ld = log_db.LogData(conf, edit = True)
+    ld.init_ltmanager()
+    lp = logparser.LogParser(conf)
+    ha = host_alias.HostAlias(conf)
+    state = FollowState(state_filename(conf))
+    d_follower = {}
+    s_compressed = set()
+
+    def _sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _sigterm)
+
+    def _targets():
+        if recur:
+            return common.recur_dir(l_path)
+        else:
+            return [fp for fp in common.rep_dir(l_path)
+                    if not os.path.isdir(fp)]
+
+    def _add_followers():
+        state.update(d_follower.values())
+        s_inode = set(follower.inode for follower in d_follower.values())
+        for fp in _targets():
+            if d_follower.has_key(fp) or fp in s_compressed:
+                continue
+            try:
+                inode = os.stat(fp).st_ino
+                ctype = common.compressed_type(fp)
+            except (OSError, IOError):
+                continue
+            if ctype is not None:
+                s_compressed.add(fp)
+                _logger.info("{0} is compressed, not followed".format(fp))
+                continue
+            if inode in s_inode:
+                # renamed in rotation, and still read with old path
+                continue
+            inode, offset, head = state.get(fp, inode)
+            d_follower[fp] = FileFollower(fp, inode, offset, head)
+            _logger.info("follow {0} from offset {1}".format(fp, offset))
+
+    def _existing_inodes():
+        s_inode = set(follower.inode for follower in d_follower.values())
+        for fp in _targets():
+            try:
+                s_inode.add(os.stat(fp).st_ino)
+            except OSError:
+                pass
+        return s_inode
+
+    def _commit():
+        ld.commit_db()
+        state.update(d_follower.values())
+        state.prune(_existing_inodes(), set(d_follower.keys()))
+        state.dump()
+
+    _logger.info("log_db follow start")
+    last_commit = time.time()
+    cnt = 0
+    try:
+        while True:
+            _add_followers()
+            for fp, follower in d_follower.iteritems():
+                for line, offset in follower.iter_lines():
+                    parsed = log_db.parse_line(line, lp, ha, drop_undefhost)
+                    log_db.process_parsed_line(line, parsed, ld)
+                    # not to skip the line if interrupted in processing
+                    follower.offset = offset
+                    cnt += 1
+            if time.time() - last_commit >= commit_interval:
+                _commit()
+                if cnt > 0:
+                    _logger.info("{0} lines committed".format(cnt))
+                    cnt = 0
+                last_commit = time.time()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        _logger.info("log_db follow interrupted")
+    finally:
+        _commit()
+        for follower in d_follower.values():
+            follower.close()
+        _logger.info("log_db follow done")
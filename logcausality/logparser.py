@@ -25,6 +25,9 @@ class LogParser():
 
     re_datetime = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
     re_year = re.compile(r"^[12]\d{3}$")
+    # timestamp part of message headers, used as keys of cached datetime
+    re_header_datetime = re.compile(r"^[^ ]+ +[^ ]+")
+    re_header = re.compile(r"^ *([12]\d{3} +)?[^ ]+ +[^ ]+ +[^ ]+")
     month_name = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
             "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
 
@@ -46,6 +49,10 @@ class LogParser():
         if self.rmheader_fl is not None and len(self.rmheader_fl) > 0:
             self._init_remove_header(self.rmheader_fl)
         self._init_splitter()
+        self._word_cache = common.LRUCache(conf.getint("log_template",
+                "split_cache_size"))
+        self._dt_cache = common.LRUCache(conf.getint("database",
+                "header_cache_size"))
 
     def _init_remove_header(self, l_fn):
         for fn in l_fn:
@@ -62,6 +69,12 @@ class LogParser():
                 buf.append(line.rstrip("\n").split("0"))
         self.spl = buf[0] # splitter
         self.cspl = buf[1] # conditional splitter (except variables in RE)
+        # splitters except space, used after splitting line with spaces
+        l_spl = [re.escape(c) for c in self.spl if not c == " "]
+        if len(l_spl) > 0:
+            self._re_spl = re.compile("([{0}])".format("".join(l_spl)))
+        else:
+            self._re_spl = None
 
     def _is_removed(self, line):
         for description in self.rm_header:
@@ -133,6 +146,74 @@ class LogParser():
             ret2 = self._split_word(w2)
             return ret1 + [(s, 's')] + ret2
 
+    def _split_cspl(self, string):
+        # partition string without splitters in reversed order,
+        # equivalent to _split_word
+        l_tail = []
+        while True:
+            for cnt in reversed(range(len(string))):
+                if string[cnt] in self.cspl:
+                    break
+            else:
+                break
+            if self._re_cspl(string):
+                break
+            l_tail.append((string[cnt+1:], 'w'))
+            l_tail.append((string[cnt], 's'))
+            string = string[:cnt]
+        l_tail.append((string, 'w'))
+        l_tail.reverse()
+        return l_tail
+
+    def _split_segment(self, string):
+        # partition string without splitters, equivalent to _split_word
+        ret = []
+        if self.sep_variable:
+            while self.varsym in string:
+                ind_s = string.find(self.varsym)
+                ind_e = ind_s + len(self.varsym)
+                if string == self.varsym:
+                    ret.append((string, 'w'))
+                    return ret
+                elif ind_s == 0:
+                    ret.append((string[0:ind_e], 'w'))
+                    ret.append(("", 's'))
+                    string = string[ind_e:]
+                else:
+                    ret += self._split_cspl(string[0:ind_s])
+                    ret.append(("", 's'))
+                    string = string[ind_s:]
+        ret += self._split_cspl(string)
+        return ret
+
+    def _split_token(self, string):
+        # partition a word without spaces, equivalent to _split_word
+        ret = self._word_cache.get(string)
+        if ret is None:
+            if self._re_spl is None:
+                l_seg = [string]
+            else:
+                l_seg = self._re_spl.split(string)
+            ret = self._split_segment(l_seg[0])
+            for i in range(1, len(l_seg), 2):
+                ret.append((l_seg[i], 's'))
+                ret += self._split_segment(l_seg[i + 1])
+            ret = tuple(ret)
+            self._word_cache.put(string, ret)
+        return ret
+
+    def _split_line(self, string):
+        # partition string and label them, equivalent to _split_word
+        # words between spaces are memorized to skip partitioning
+        if not " " in self.spl:
+            return list(self._split_token(string))
+        ret = []
+        for cnt, token in enumerate(string.split(" ")):
+            if cnt > 0:
+                ret.append((" ", 's'))
+            ret.extend(self._split_token(token))
+        return ret
+
     @staticmethod
     def _merge_sym(l_elem):
         # merge continuous symbol strings
@@ -157,7 +238,7 @@ class LogParser():
         return l_w, l_s
 
     def split_message(self, line):
-        ret = self._split_word(line.rstrip("\n"))
+        ret = self._split_line(line.rstrip("\n"))
         l_w, l_s = self._merge_sym(ret)
         if self.sym_ignore:
             return l_w, l_s
@@ -172,23 +253,24 @@ class LogParser():
             return ret, None
             #return [i[0] for i in ret if not i[0] == ""], None
 
-    def pop_header(self, src_line):
-
-        def pop_string(line):
-            line = line.strip(" ")
-            if " " in line:
-                string, line = line.split(" ", 1)
-                return string, line
-            else:
-                return line, ""
+    @staticmethod
+    def _pop_string(line):
+        line = line.strip(" ")
+        if " " in line:
+            string, line = line.split(" ", 1)
+            return string, line
+        else:
+            return line, ""
 
-        def str2month(string):
-            if not string in self.month_name:
-                return None
-            else:
-                return self.month_name.index(string) + 1
+    def _str2month(self, string):
+        if not string in self.month_name:
+            return None
+        else:
+            return self.month_name.index(string) + 1
 
-        line = src_line[:]
+    def _pop_header(self, line):
+        pop_string = self._pop_string
+        str2month = self._str2month
 
         try:
             if self.re_datetime.match(line):
@@ -223,12 +305,50 @@ class LogParser():
                         second = second, microsecond = 0)
         except:
             return None, None, None
+        return dt, host, message
+
+    def _pop_header_cache(self, line):
+        # use timestamp strings before hostname as a key of cached datetime
+        if self.re_datetime.match(line):
+            mobj = self.re_header_datetime.match(line)
+            key = mobj.group()
+        else:
+            mobj = self.re_header.match(line)
+            if mobj is None:
+                return None, None, None
+            key = mobj.group()
+            if mobj.group(1) is None:
+                # year is not given in the message
+                key = (self._set_year(), key)
+
+        dt = self._dt_cache.get(key)
+        if dt is None:
+            dt, host, message = self._pop_header(line)
+            if dt is not None:
+                self._dt_cache.put(key, dt)
+        else:
+            host, message = self._pop_string(line[mobj.end():])
+        return dt, host, message
+
+    def pop_header(self, src_line):
+        line = src_line[:]
+        if self._dt_cache.size > 0:
+            dt, host, message = self._pop_header_cache(line)
+        else:
+            dt, host, message = self._pop_header(line)
+        if dt is None:
+            return None, None, None
 
         if self.header_size is not None:
             #message = line.split()[self.header_size:]
             message = " ".join(src_line.split()[self.header_size:])
         return dt, host, message
 
+    def cache_stat(self):
+        """str: Show hit and miss counts of caches in this parser."""
+        return "\n".join(("word split cache : " + self._word_cache.stat(),
+                "timestamp cache : " + self._dt_cache.stat()))
+
     def process_line(self, line):
         line = line.rstrip("\n")
         if line == "":
@@ -256,6 +376,34 @@ def test_parse(conf):
     return ret
 
 
+def test_split(conf, targets = None, sep_variable = False):
+    """Compare LogParser._split_line with the reference recursive
+    implementation LogParser._split_word on given files.
+    The result of split_message must not be changed by the tokenizer.
+
+    Returns:
+        int: Number of messages with different results.
+    """
+    LP = LogParser(conf, sep_variable = sep_variable)
+    if targets is None:
+        targets = common.rep_dir(conf.getlist("general", "src_path"))
+    cnt = 0
+    cnt_diff = 0
+    for fp in targets:
+        with open(fp, 'r') as f:
+            for line in f:
+                dt, host, message = LP.pop_header(line.rstrip("\n"))
+                if message is None:
+                    continue
+                cnt += 1
+                if not LP._split_line(message) == LP._split_word(message):
+                    cnt_diff += 1
+                    print "different result : {0}".format(message)
+    print "{0} / {1} messages differ".format(cnt_diff, cnt)
+    print LP.cache_stat()
+    return cnt_diff
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         sys.exit("usage: {0} config targets".format(sys.argv[0]))
@@ -2,9 +2,11 @@
 # coding: utf-8
 
 import os
+import array
 import cPickle as pickle
 from collections import defaultdict
 
+import common
 import strutil
 
 
@@ -35,6 +37,12 @@ class LTManager(object):
         self._db = db
         self._lttable = lttable
         self._table = TemplateTable()
+        # ltids with counts not yet written to DB (flushed in flush_count)
+        self._s_counted = set()
+        # key : tuple of words, val : ltid
+        # cleared when existing log templates are changed
+        self._cache = common.LRUCache(conf.getint("log_template",
+                "lt_cache_size"))
         self.ltgen = None
         self.ltspl = None
         self.ltgroup = None
@@ -55,6 +63,8 @@ class LTManager(object):
         Args:
             lines [List[Tuple[str]]]: A sequence of lines which is
                     presented in a tuple of l_w and l_s.
+                    It is iterated twice, so give a list or
+                    a re-iterable object (not a generator).
         """
         d = self.ltgen.process_init_data(l_line)
         for mid, line in enumerate(l_line):
@@ -92,9 +102,19 @@ class LTManager(object):
                     ret.append(w)
             return ret
 
+        # same messages are classified into same log template
+        # until existing templates are changed
+        key = tuple(l_w)
+        ltid = self._cache.get(key)
+        if ltid is not None:
+            self.count_lt(ltid)
+            return self._lttable[ltid]
+
         tid, state = self.ltgen.process_line(l_w, l_s)
         if tid is None:
             return None
+        if state == LTGen.state_changed:
+            self._cache.clear()
 
         tpl = self._table[tid]
         ltw = self.ltspl.replace_variable(l_w, tpl, self.sym)
@@ -124,6 +144,7 @@ class LTManager(object):
                     raise AssertionError
                 ltline = self._lttable[ltid]
     
+        self._cache.put(key, ltline.ltid)
         return ltline
 
     def add_lt(self, l_w, l_s, cnt = 1):
@@ -137,22 +158,45 @@ class LTManager(object):
         return ltline
 
     def replace_lt(self, ltid, l_w, l_s = None, cnt = None):
+        self._cache.clear()
         self._lttable[ltid].replace(l_w, l_s, cnt)
+        self.ltgroup.replace_lt(self._lttable[ltid])
         self._db.update_lt(ltid, l_w, l_s, cnt)
     
     def replace_and_count_lt(self, ltid, l_w, l_s = None):
-        cnt = self._lttable[ltid].count()
+        self._cache.clear()
+        self._lttable[ltid].count()
         self._lttable[ltid].replace(l_w, l_s, None)
-        self._db.update_lt(ltid, l_w, l_s, cnt)
+        self.ltgroup.replace_lt(self._lttable[ltid])
+        self._db.update_lt(ltid, l_w, l_s, None)
+        self._s_counted.add(ltid)
 
     def count_lt(self, ltid):
-        cnt = self._lttable[ltid].count()
-        self._db.update_lt(ltid, None, None, cnt)
+        # counts are written to DB at once in flush_count
+        self._lttable[ltid].count()
+        self._s_counted.add(ltid)
+
+    def flush_count(self):
+        """Write counts of log templates updated after the last call
+        into DB. Call this before committing DB."""
+        if len(self._s_counted) == 0:
+            return
+        l_count = [(ltid, self._lttable[ltid].cnt)
+                   for ltid in self._s_counted]
+        self._s_counted = set()
+        self._db.update_lt_count(l_count)
 
     def remove_lt(self, ltid):
+        self._cache.clear()
+        self._s_counted.discard(ltid)
         self._lttable.remove_lt(ltid)
+        self.ltgroup.remove_lt(ltid)
         self._db.remove_lt(ltid)
 
+    def cache_stat(self):
+        """str: Show hit and miss counts of the cache of messages."""
+        return "log template cache : " + self._cache.stat()
+
     def remake_ltg(self):
         self._db.reset_ltg()
         self.ltgroup.init_dict()
@@ -165,6 +209,7 @@ class LTManager(object):
             self.ltgroup._lttable.add_lt(ltline)
             self._db.add_ltg(ltline.ltid, ltgid)
         assert self.ltgroup._lttable.ltdict == temp_lttable.ltdict
+        self._db.update_log_ltgid()
 
     def failure_output(self, line):
         with open(self._fail_fn, "a") as f:
@@ -179,11 +224,14 @@ class LTManager(object):
         self.ltgen.load(ltgen_data)
         self.ltgroup.load(ltgroup_data)
 
-    def dump(self):
+    def dumpobj(self):
         table_data = self._table.dumpobj()
         ltgen_data = self.ltgen.dumpobj()
         ltgroup_data = self.ltgroup.dumpobj()
-        obj = (table_data, ltgen_data, ltgroup_data)
+        return (table_data, ltgen_data, ltgroup_data)
+
+    def dump(self):
+        obj = self.dumpobj()
         with open(self.filename, 'w') as f:
             pickle.dump(obj, f)
 
@@ -229,7 +277,9 @@ class LTTable():
         self.ltdict.pop(ltid)
 
 
-class LogTemplate():
+class LogTemplate(object):
+
+    __slots__ = ("ltid", "ltgid", "ltw", "lts", "cnt", "sym")
 
     def __init__(self, ltid, ltgid, ltw, lts, count, sym):
         if len(ltw) == 0:
@@ -382,12 +432,15 @@ class LTGen(object):
     def process_init_data(self, lines):
         """If there is no need of special process for init phase,
         this function simply call process_line multiple times.
+
+        Returns:
+            array.array: Template ids of given lines, in the same order.
         """
-        d = {}
-        for mid, line in enumerate(lines):
+        d = array.array("l")
+        for line in lines:
             l_w, l_s = line
             tid, state = self.process_line(l_w, l_s)
-            d[mid] = tid
+            d.append(tid)
         return d
 
     def process_line(self, l_w, l_s):
@@ -423,12 +476,15 @@ class LTGroup(object):
     def init_dict(self):
         self.d_group = {} # key : groupid, val : [ltline, ...]
         self.d_rgroup = {} # key : ltid, val : groupid
+        self._gid_hint = 0 # groupids less than this are used
 
     def _next_groupid(self):
-        cnt = 0
+        # groups are not removed, so used groupids are not searched again
+        cnt = self._gid_hint
         while self.d_group.has_key(cnt):
             cnt += 1
         else:
+            self._gid_hint = cnt
             return cnt
 
     def add(self, ltline):
@@ -445,6 +501,14 @@ class LTGroup(object):
             self.d_group.setdefault(ltgid, []).append(table[ltid])
             self.d_rgroup[ltid] = ltgid
 
+    def replace_lt(self, ltline):
+        # called after words of an existing log template are replaced
+        pass
+
+    def remove_lt(self, ltid):
+        # called after a log template is removed
+        pass
+
     def load(self, loadobj):
         pass
 
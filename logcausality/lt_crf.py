@@ -114,14 +114,14 @@ def generate_lt_from_file(conf, fn):
     sym = conf.get("log_template", "variable_symbol")
     d_symlist = {}
     ltgen = LTGenCRF(table, sym, conf)
+    mmap_size = conf.getint("general", "src_mmap_size")
     
-    with open(fn, "r") as f:
-        for line in f:
-            dt, org_host, l_w, l_s = lp.process_line(line)
-            if l_w is None: continue
-            l_w = [strutil.add_esc(w) for w in l_w]
-            tid, dummy = ltgen.process_line(l_w, l_s)
-            d_symlist[tid] = l_s
+    for line in common.iter_lines(fn, mmap_size):
+        dt, org_host, l_w, l_s = lp.process_line(line)
+        if l_w is None: continue
+        l_w = [strutil.add_esc(w) for w in l_w]
+        tid, dummy = ltgen.process_line(l_w, l_s)
+        d_symlist[tid] = l_s
 
     ret = []
     for tid in table.tids():
@@ -146,6 +146,7 @@ def separate_ltid(ld, ltid, vid, value, sym):
     ltw2, cnt2 = remake_lt(ld, new_ltid)
     ltline = ld.ltm.add_lt(ltw2, l_s, cnt2)
     assert ltline.ltid == new_ltid
+    ld.db.update_log_ltgid([new_ltid])
 
     ld.commit_db()
 
@@ -12,9 +12,11 @@ Do NOT edit log templates manually if you still have unprocessed log data.
 """
 
 import sys
+import bisect
 import logging
 import optparse
 import cPickle as pickle
+from collections import defaultdict
 import numpy
 
 import config
@@ -22,12 +24,23 @@ import lt_common
 
 _logger = logging.getLogger(__name__.rpartition(".")[-1])
 
+# character classes of bytes in words for seq_ratio
+# 54 dimensions : A-Z, a-z, digit, symbol(others)
+_N_CHAR_CLASS = 26 + 26 + 2
+_char_class = numpy.empty(256, dtype = numpy.intp)
+_char_class.fill(_N_CHAR_CLASS - 1)
+_char_class[ord("A"):ord("Z") + 1] = numpy.arange(26)
+_char_class[ord("a"):ord("z") + 1] = numpy.arange(26, 52)
+_char_class[ord("0"):ord("9") + 1] = _N_CHAR_CLASS - 2
+
 
 class LTGenNode():
 
-    def __init__(self, tid = None):
+    def __init__(self, tid = None, length = None):
         self.l_child = []
+        self.d_child = {} # key : length of template, val : [LTGenNode, ...]
         self.tid = tid
+        self.length = length
 
     def __len__(self):
         return len(self.l_child)
@@ -37,6 +50,12 @@ class LTGenNode():
 
     def join(self, node):
         self.l_child.append(node)
+        self.d_child.setdefault(node.length, []).append(node)
+
+    def children(self, length):
+        """List[LTGenNode]: Children with templates of given length,
+        in the order of joining."""
+        return self.d_child.get(length, [])
 
 
 class LTGenSHISO(lt_common.LTGen):
@@ -46,21 +65,36 @@ class LTGenSHISO(lt_common.LTGen):
         self._n_root = LTGenNode()
         self.threshold = threshold
         self.max_child = max_child
+        self._d_vec = {} # key : tid, val : (template, word vectors)
 
     def load(self, loadobj):
         self._n_root = loadobj
+        if not hasattr(self._n_root, "d_child"):
+            # tree dumped without the index of children with length
+            l_node = [self._n_root]
+            while len(l_node) > 0:
+                node = l_node.pop()
+                node.d_child = {}
+                for n_child in node.l_child:
+                    n_child.length = len(self._table[n_child.tid])
+                    node.d_child.setdefault(n_child.length, []).append(
+                            n_child)
+                    l_node.append(n_child)
 
     def dumpobj(self):
         return self._n_root
 
     def process_line(self, l_w, l_s):
         n_parent = self._n_root
+        vec = word_vectors(l_w, self._sym)
         while True:
-            for n_child in n_parent:
+            # seq_ratio of templates with different length is 0.0,
+            # so only children with same length can be merged
+            for n_child in n_parent.children(len(l_w)):
                 _logger.debug(
                         "comparing with tid {0}".format(n_child.tid))
                 nc_tpl = self._table[n_child.tid]
-                sr = self.seq_ratio(nc_tpl, l_w)
+                sr = vector_ratio(self._template_vectors(n_child.tid), vec)
                 _logger.debug("seq_ratio : {0}".format(sr))
                 if sr >= self.threshold:
                     _logger.debug(
@@ -74,19 +108,41 @@ class LTGenSHISO(lt_common.LTGen):
             else:
                 if len(n_parent) < self.max_child:
                     _logger.debug("no node to be merged, add new node")
-                    n_child = LTGenNode(self._table.next_tid())
+                    n_child = LTGenNode(self._table.next_tid(), len(l_w))
                     n_parent.join(n_child)
                     state = self.update_table(l_w, n_child.tid, True)
                     return n_child.tid, state
                 else:
                     _logger.debug("children : {0}".format(
                             [e.tid for e in n_parent.l_child]))
-                    l_sim = [(edit_distance(self._table[n_child.tid], l_w,
-                            self._sym), n_child) for n_child in n_parent]
-                    n_parent = max(l_sim, key=lambda x: x[0])[1]
+                    # go down to the child with largest edit distance
+                    # distance is not larger than the longer length,
+                    # so children that cannot exceed the current largest
+                    # are not compared
+                    n_max = None
+                    d_max = None
+                    for n_child in n_parent:
+                        if d_max is not None and \
+                                max(n_child.length, len(l_w)) <= d_max:
+                            continue
+                        d = edit_distance(self._table[n_child.tid], l_w,
+                                self._sym)
+                        if d_max is None or d > d_max:
+                            n_max = n_child
+                            d_max = d
+                    n_parent = n_max
                     _logger.debug("go down to node(tid {0})".format(
                             n_parent.tid))
 
+    def _template_vectors(self, tid):
+        # word vectors of templates are reused until the template changes
+        tpl = self._table[tid]
+        cache = self._d_vec.get(tid)
+        if cache is None or not cache[0] == tpl:
+            cache = (tpl[:], word_vectors(tpl, self._sym))
+            self._d_vec[tid] = cache
+        return cache[1]
+
     def seq_ratio(self, m1, m2):
 
         #def c_coordinate(w):
@@ -105,40 +161,8 @@ class LTGenSHISO(lt_common.LTGen):
         #    deno = numpy.linalg.norm(l_cnt)
         #    return [1.0 * e / deno for e in l_cnt]
 
-        def c_coordinate(w):
-            l_cnt = [0.0 for i in range(26 + 26 + 2)] # A-Z, a-z, digit, symbol
-            for c in w:
-                if c.isupper():
-                    ind = ord(c) - 65
-                    l_cnt[ind] += 1.0
-                elif c.islower():
-                    ind = ord(c) - 97
-                    l_cnt[ind + 26] += 1.0
-                elif c.isdigit():
-                    l_cnt[-2] += 1.0
-                else:
-                    l_cnt[-1] += 1.0
-            deno = numpy.linalg.norm(l_cnt)
-            return [1.0 * e / deno for e in l_cnt]
-
-        if len(m1) == len(m2):
-            length = len(m1)
-            if length == 0:
-                return 1.0
-
-            sum_dist = 0.0
-            for w1, w2 in zip(m1, m2):
-                if w1 == self._sym or w2 == self._sym:
-                    pass
-                else:
-                    c_w1 = c_coordinate(w1)
-                    c_w2 = c_coordinate(w2)
-                    dist = sum([numpy.power(e1 - e2, 2)
-                            for e1, e2 in zip(c_w1, c_w2)])
-                    sum_dist += dist
-            return 1.0 - (sum_dist / (2.0 * length))
-        else:
-            return 0.0
+        return vector_ratio(word_vectors(m1, self._sym),
+                            word_vectors(m2, self._sym))
 
     def equal(self, m1, m2):
         if len(m1) == len(m2):
@@ -166,31 +190,40 @@ class LTGroupSHISO(lt_common.LTGroup):
         self.th_lookup = th_lookup
         self.th_distance = th_distance
         self.mem_ngram = mem_ngram
-        if self.mem_ngram:
-            self.d_ngram = {} # key : ltid, val : [str, ...]
+
+    def init_dict(self):
+        super(LTGroupSHISO, self).init_dict()
+        self.d_ngram = {} # key : ltid, val : [ngram, ...]
+        self._d_index = {} # key : ngram, val : sorted [ltid, ...]
 
     def add(self, lt_new):
         _logger.debug("group search for ltid {0}".format(lt_new.ltid))
 
+        self._sync_index()
         r_max = 0.0
         lt_max = None
-        l_cnt = [0 for i in self._lttable]
+        d_cnt = defaultdict(int) # key : ltid, val : number of common ngrams
         l_ng1 = self._get_ngram(lt_new)
         for ng in l_ng1:
-            for lt_temp, l_ng2 in self._lookup_ngram(ng):
-                l_cnt[lt_temp.ltid] += 1
-                r = 2.0 * l_cnt[lt_temp.ltid] / (len(l_ng1) + len(l_ng2)) 
+            for ltid in self._d_index.get(ng, []):
+                d_cnt[ltid] += 1
+                r = 2.0 * d_cnt[ltid] / (len(l_ng1) + len(ng))
                 if r > r_max:
                     r_max = r
-                    lt_max = lt_temp
-        _logger.debug("ngram co-occurrance map : {0}".format(l_cnt))
+                    lt_max = self._lttable[ltid]
+        self._add_index(lt_new.ltid, l_ng1)
+        _logger.debug("ngram co-occurrance map : {0}".format(dict(d_cnt)))
         _logger.debug("r_max : {0}".format(r_max))
         if r_max > self.th_lookup:
             assert lt_max is not None, "bad threshold for lt group lookup"
             _logger.debug("lt_max ltid : {0}".format(lt_max.ltid))
             ltw2 = lt_max.ltw
-            d = 2.0 * edit_distance(lt_new.ltw, lt_max.ltw, self._sym) / \
-                    (len(lt_new.ltw) + len(lt_max.ltw))
+            # distance is computed exactly only if it can be
+            # under th_distance
+            len_sum = len(lt_new.ltw) + len(lt_max.ltw)
+            cutoff = int(self.th_distance * len_sum / 2.0) + 1
+            d = 2.0 * edit_distance(lt_new.ltw, lt_max.ltw, self._sym,
+                    cutoff) / len_sum
             _logger.debug("edit distance ratio : {0}".format(d))
             if d < self.th_distance:
                 gid = self._mk_group(lt_new, lt_max)
@@ -224,53 +257,168 @@ class LTGroupSHISO(lt_common.LTGroup):
         return groupid
 
     def _get_ngram(self, ltline):
-
-        def ngram(ltw, length):
-            return [ltw[i:i+length] for i in range(len(ltw) - length)]
-            
-        if self.mem_ngram:
-            if not self.d_ngram.has_key(ltline.ltid):
-                self.d_ngram[ltline.ltid] = \
-                        ngram(ltline.ltw, self.ngram_length)
-            return self.d_ngram[ltline.ltid]
-        else:
-            return ngram(ltline.ltw, self.ngram_length)
-
-    def _lookup_ngram(self, ng):
-        ret = []
-        for ltline in self._lttable:
-            if ng in self._get_ngram(ltline):
-                ret.append((ltline, ng))
-        return ret
+        ltw = ltline.ltw
+        length = self.ngram_length
+        return [tuple(ltw[i:i+length]) for i in range(len(ltw) - length)]
+
+    def _add_index(self, ltid, l_ng):
+        # inverted index from ngrams to ltids, in ltid order
+        if self.d_ngram.has_key(ltid):
+            self._remove_index(ltid)
+        self.d_ngram[ltid] = l_ng
+        for ng in set(l_ng):
+            l_ltid = self._d_index.setdefault(ng, [])
+            if len(l_ltid) == 0 or l_ltid[-1] < ltid:
+                l_ltid.append(ltid)
+            else:
+                bisect.insort(l_ltid, ltid)
+
+    def _remove_index(self, ltid):
+        for ng in set(self.d_ngram.pop(ltid)):
+            l_ltid = self._d_index[ng]
+            l_ltid.remove(ltid)
+            if len(l_ltid) == 0:
+                self._d_index.pop(ng)
+
+    def replace_lt(self, ltline):
+        # ngrams of replaced words
+        if self.d_ngram.has_key(ltline.ltid):
+            self._add_index(ltline.ltid, self._get_ngram(ltline))
+
+    def remove_lt(self, ltid):
+        if self.d_ngram.has_key(ltid):
+            self._remove_index(ltid)
+
+    def _sync_index(self):
+        # index log templates added or removed without this object
+        # (e.g., restored from DB without dumped ngrams)
+        ltdict = self._lttable.ltdict
+        if len(self.d_ngram) == len(ltdict):
+            return
+        for ltid in self.d_ngram.keys():
+            if not ltdict.has_key(ltid):
+                self._remove_index(ltid)
+        for ltid, ltline in sorted(ltdict.iteritems()):
+            if not self.d_ngram.has_key(ltid):
+                self._add_index(ltid, self._get_ngram(ltline))
 
     def load(self, obj):
-        pass
+        # without dumped ngrams, they are made from lttable in next add
+        if obj is not None:
+            for ltid, l_ng in sorted(obj.iteritems()):
+                self._add_index(ltid, l_ng)
 
     def dumpobj(self):
-        return None
-
-
-def edit_distance(m1, m2, sym):
-    # return levenshtein distance that allows wildcard
-
-    table = [ [0] * (len(m2) + 1) for i in range(len(m1) + 1) ]
-
-    for i in range(len(m1) + 1):
-        table[i][0] = i
-
-    for j in range(len(m2) + 1):
-        table[0][j] = j
-
-    for i in range(1, len(m1) + 1):
-        for j in range(1, len(m2) + 1):
-            if (m1[i - 1] == m2[j - 1]) or \
-                    m1[i - 1] == sym or m2[j - 1] == sym:
-                cost = 0
-            else:
-                cost = 1
-            table[i][j] = min(table[i - 1][j] + 1, table[i][ j - 1] + 1, \
-                    table[i - 1][j - 1] + cost)
-    return table[-1][-1]
+        if self.mem_ngram:
+            return self.d_ngram
+        else:
+            return None
+
+
+def word_vectors(l_w, sym):
+    """Vectorize words for seq_ratio.
+
+    Args:
+        l_w (List[str]): Words of a log message or a log template.
+        sym (str): Variable symbol, that matches any word.
+
+    Returns:
+        mat (numpy.ndarray): Normalized vectors of numbers of characters
+            in each class (A-Z, a-z, digit, symbol) for each word (in rows).
+        mask (numpy.ndarray): Words that are not variable symbol.
+    """
+    length = len(l_w)
+    mask = numpy.array([not w == sym for w in l_w], dtype = bool)
+    if length == 0:
+        return numpy.zeros((0, _N_CHAR_CLASS)), mask
+    a_len = numpy.array([len(w) for w in l_w], dtype = numpy.intp)
+    a_char = numpy.frombuffer("".join(l_w), dtype = numpy.uint8)
+    # count characters of all words at once with indexes of
+    # (word, character class) in a flattened matrix
+    a_ind = numpy.repeat(numpy.arange(length) * _N_CHAR_CLASS, a_len) + \
+            _char_class[a_char]
+    mat = numpy.bincount(a_ind, minlength = length * _N_CHAR_CLASS
+            ).reshape(length, _N_CHAR_CLASS).astype(float)
+    mat /= numpy.sqrt((mat ** 2).sum(axis = 1))[:, numpy.newaxis]
+    return mat, mask
+
+
+def vector_ratio(vec1, vec2):
+    """SeqRatio of 2 sequences of words given with word_vectors.
+    Words of different length sequences are not similar (0.0)."""
+    mat1, mask1 = vec1
+    mat2, mask2 = vec2
+    length = len(mask1)
+    if not length == len(mask2):
+        return 0.0
+    elif length == 0:
+        return 1.0
+    mask = mask1 & mask2
+    sum_dist = ((mat1[mask] - mat2[mask]) ** 2).sum()
+    return 1.0 - (sum_dist / (2.0 * length))
+
+
+def edit_distance(m1, m2, sym, cutoff = None):
+    """Levenshtein distance of 2 sequences of words, in which variable
+    symbol matches any word. A column of the distance table is
+    computed at once as bit vectors of integers (Myers 1999, Hyyro 2001).
+
+    Args:
+        m1 (List[str]): A sequence of words.
+        m2 (List[str]): Another sequence of words.
+        sym (str): Variable symbol.
+        cutoff (Optional[int]): If given, computation stops as soon as
+            the distance is found to be larger than cutoff,
+            and cutoff + 1 is returned instead of the distance.
+
+    Returns:
+        int
+    """
+    len1 = len(m1)
+    len2 = len(m2)
+    if cutoff is not None and abs(len1 - len2) > cutoff:
+        return cutoff + 1
+    elif len1 == 0:
+        return len2
+    elif len2 == 0:
+        return len1
+
+    # bit i of match vectors : word i of m1 matches the word of m2
+    mask = (1 << len1) - 1
+    high = 1 << (len1 - 1)
+    eq_sym = 0
+    d_eq = {}
+    for i, w in enumerate(m1):
+        if w == sym:
+            eq_sym |= 1 << i
+        else:
+            d_eq[w] = d_eq.get(w, 0) | (1 << i)
+
+    # vertical positive / negative differences of the column
+    pv = mask
+    mv = 0
+    score = len1
+    for j, w in enumerate(m2):
+        if w == sym:
+            eq = mask
+        else:
+            eq = d_eq.get(w, 0) | eq_sym
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        # the distance decreases at most 1 for each remaining word
+        if cutoff is not None and score - (len2 - j - 1) > cutoff:
+            return cutoff + 1
+    return score
 
 
 #def test_ltgen(conf):
@@ -189,6 +189,9 @@ def pc_mprocess(l_args, pal=1):
     import multiprocessing
     timer = common.Timer("pc_log task", output = _logger)
     timer.start()
+    if len(l_args) > 0:
+        # forked processes use log templates loaded here
+        log_db.init_shared(l_args[0][0])
     l_process = [multiprocessing.Process(name = thread_name(*args),
         target = pc_log, args = args) for args in l_args]
     common.mprocess_queueing(l_process, pal)
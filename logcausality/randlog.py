@@ -51,6 +51,7 @@ def add_db(conf, l_event, verbose, reset_db):
         msg = message(eid, t)
         log_db.process_line(msg, ld, lp, ha)
         if verbose: print msg
+    ld.commit_db()
 
 
 if __name__ == "__main__":